@@ -0,0 +1,124 @@
+"""
+AI metadata for designs: the response model and the vision request.
+"""
+
+import base64
+import mmap
+from pathlib import Path
+from typing import Optional, Union
+
+from pydantic import BaseModel, ConfigDict
+
+
+class AIMetadata(BaseModel):
+    """AI-generated metadata for a design."""
+    # Strict structured outputs require every field and no extras
+    model_config = ConfigDict(extra="forbid")
+
+    title: str
+    description: str
+    project_type: Optional[str]
+    difficulty: Optional[str]
+    materials: list[str]
+    categories: list[str]
+    style: Optional[str]
+    tags: list[str]
+    approx_dimensions: Optional[str]
+
+
+# Structured output format: the model's reply is guaranteed to parse as AIMetadata
+AI_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "design_metadata",
+        "strict": True,
+        "schema": AIMetadata.model_json_schema(),
+    },
+}
+
+
+def build_ai_request(preview: Union[Path, bytes], filename: str, model: str) -> dict:
+    """Build the chat completion arguments for one design preview."""
+    # Encode image; generated previews are already in memory, files on disk
+    # are mapped so their bytes aren't copied into Python before encoding
+    if isinstance(preview, bytes):
+        image_data = base64.b64encode(preview).decode("ascii")
+        mime_type = "image/png"
+    else:
+        with open(preview, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            image_data = base64.b64encode(mm).decode("ascii")
+
+        # Determine mime type
+        ext = preview.suffix.lower()
+        mime_type = {
+            ".png": "image/png",
+            ".jpg": "image/jpeg",
+            ".jpeg": "image/jpeg",
+            ".webp": "image/webp",
+        }.get(ext, "image/png")
+
+    return {
+        "model": model,
+        "messages": [
+            {
+                "role": "system",
+                "content": """You are analyzing CNC/laser cutting design files.
+                Extract metadata and return valid JSON with these fields:
+                - title: A descriptive title (without file extension)
+                - description: 2-3 sentence description of the design
+                - project_type: One of: coaster, sign, ornament, box, puzzle, jig, art, other
+                - difficulty: One of: easy, medium, hard
+                - materials: Array of suitable materials (wood, acrylic, leather, paper, metal)
+                - categories: Array of categories
+                - style: Design style (mandala, geometric, floral, minimal, detailed, celtic, tribal, etc.)
+                - tags: Array of descriptive tags (max 10)
+                - approx_dimensions: Estimated dimensions if visible (e.g., "4 inch diameter")
+
+                Return ONLY valid JSON, no markdown or explanation."""
+            },
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": f"Analyze this CNC/laser design. Filename: {filename}"
+                    },
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": f"data:{mime_type};base64,{image_data}"
+                        }
+                    }
+                ]
+            }
+        ],
+        "response_format": AI_RESPONSE_FORMAT,
+        "max_completion_tokens": 500,
+    }
+
+
+def parse_ai_response(content: str, filename: str) -> AIMetadata:
+    """Parse the model's structured JSON reply into AIMetadata."""
+    metadata = AIMetadata.model_validate_json(content)
+    if not metadata.title.strip():
+        metadata.title = basic_metadata(filename).title
+    return metadata
+
+
+def basic_metadata(filename: str) -> AIMetadata:
+    """Generate basic metadata from filename."""
+    # Clean up filename for title
+    name = Path(filename).stem
+    title = name.replace("-", " ").replace("_", " ").title()
+
+    return AIMetadata(
+        title=title,
+        description="",
+        project_type=None,
+        difficulty=None,
+        materials=[],
+        categories=[],
+        style=None,
+        tags=[],
+        approx_dimensions=None,
+    )
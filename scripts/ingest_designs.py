@@ -18,39 +18,27 @@ Features:
 
 import os
 import sys
-import hashlib
-import json
-import re
-import tempfile
+import logging
+import threading
 from pathlib import Path
-from datetime import datetime
-from typing import Optional
+from typing import Optional, Union
 from dataclasses import dataclass
-from io import BytesIO
 
+import httpx
 from dotenv import load_dotenv
-from supabase import create_client, Client
+from supabase import create_client, Client, ClientOptions
 from PIL import Image
-import imagehash
-from openai import OpenAI
+from openai import AsyncOpenAI
 from tqdm import tqdm
 
-# Optional imports for preview generation
-try:
-    import cairosvg
-    HAS_CAIROSVG = True
-except ImportError:
-    HAS_CAIROSVG = False
-    print("Warning: cairosvg not installed. SVG preview generation disabled.")
-
-try:
-    import ezdxf
-    from ezdxf.addons.drawing import matplotlib as dxf_matplotlib
-    import matplotlib.pyplot as plt
-    HAS_EZDXF = True
-except ImportError:
-    HAS_EZDXF = False
-    print("Warning: ezdxf/matplotlib not installed. DXF preview generation disabled.")
+from ingest_ai import AIMetadata, basic_metadata, build_ai_request, parse_ai_response
+from ingest_files import compute_content_hashes_batch, walk_design_files
+from ingest_logging import setup_logging
+from ingest_phash import compute_phashes_batch, phash_input
+from ingest_pipeline import IngestPipeline
+from ingest_previews import PreviewRenderer, resample_filter
+from ingest_seen_cache import SeenCache
+from ingest_store import DesignStore
 
 # Load environment variables
 load_dotenv()
@@ -61,13 +49,33 @@ SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
 OPENAI_API_KEY = os.getenv("AI_API_KEY")
 AI_MODEL = os.getenv("AI_MODEL", "gpt-5-mini")
 
-# Supported file extensions
-SUPPORTED_EXTENSIONS = {".svg", ".dxf", ".ai", ".eps", ".pdf", ".cdr"}
-PREVIEW_EXTENSIONS = {".png", ".jpg", ".jpeg", ".webp"}
+# Pipeline stage sizes, each matched to the resource the stage waits on.
+# Hashing and preview rendering are local disk/CPU work
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(os.cpu_count() or 4)))
+PREVIEW_WORKERS = int(os.getenv("PREVIEW_WORKERS", str(os.cpu_count() or 4)))
+# Max in-flight OpenAI vision requests
+AI_CONCURRENCY = int(os.getenv("AI_CONCURRENCY", "16"))
+# Upload and database writes (dominated by network round-trips)
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "8"))
 
-# Preview settings
-PREVIEW_MAX_SIZE = (800, 800)
-PREVIEW_QUALITY = 85
+# Max previews whose pHashes are computed in one batched DCT
+PHASH_BATCH_SIZE = 32
+
+# Per-file progress log (rotated); warnings and errors are also shown on the console
+LOG_PATH = Path(os.getenv(
+    "INGEST_LOG", str(Path.home() / ".cache" / "psykeus-ingest" / "ingest.log")
+))
+
+logger = logging.getLogger("ingest")
+
+# Local record of files seen by earlier runs; set to an empty string to disable
+SEEN_CACHE_PATH = os.getenv(
+    "INGEST_SEEN_CACHE",
+    str(Path.home() / ".cache" / "psykeus-ingest" / "seen.sqlite"),
+)
+
+# Resampling filter for preview thumbnails (e.g. BICUBIC for speed on stock Pillow)
+RESAMPLE = resample_filter(os.getenv("PREVIEW_RESAMPLE", "LANCZOS"))
 
 
 @dataclass
@@ -77,20 +85,13 @@ class DesignFile:
     content_hash: str
     size_bytes: int
     file_type: str
-
-
-@dataclass
-class AIMetadata:
-    """AI-generated metadata for a design."""
-    title: str
-    description: str
-    project_type: Optional[str]
-    difficulty: Optional[str]
-    materials: list[str]
-    categories: list[str]
-    style: Optional[str]
-    tags: list[str]
-    approx_dimensions: Optional[str]
+    relative_path: str = ""
+    mtime_ns: int = 0
+    existing: Optional[dict] = None
+    preview: Union[Path, bytes, None] = None
+    phash: Optional[str] = None
+    phash_input: Optional[Image.Image] = None
+    metadata: Optional[AIMetadata] = None
 
 
 class DesignIngester:
@@ -100,8 +101,29 @@ class DesignIngester:
         if not SUPABASE_URL or not SUPABASE_SERVICE_KEY:
             raise ValueError("Missing Supabase credentials in environment")
 
-        self.supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
-        self.openai = OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
+        # One pooled HTTP/2 client shared by PostgREST and Storage, so the
+        # hundreds of per-file calls reuse warm TLS connections.
+        # Reason: needs supabase>=2.22.3; older postgrest/storage3 overwrite the
+        # passed client's base_url, so Storage init redirected every DB write.
+        self.http = httpx.Client(
+            http2=True,
+            follow_redirects=True,
+            timeout=httpx.Timeout(120.0, connect=10.0),
+            limits=httpx.Limits(
+                max_connections=100,
+                max_keepalive_connections=max(32, INGEST_WORKERS),
+            ),
+        )
+        supabase: Client = create_client(
+            SUPABASE_URL,
+            SUPABASE_SERVICE_KEY,
+            options=ClientOptions(httpx_client=self.http),
+        )
+        self.store = DesignStore(supabase)
+        self.previews = PreviewRenderer(RESAMPLE)
+        self.seen = (
+            SeenCache(Path(SEEN_CACHE_PATH), instance=SUPABASE_URL) if SEEN_CACHE_PATH else None
+        )
         self.stats = {
             "scanned": 0,
             "skipped_duplicate": 0,
@@ -110,545 +132,348 @@ class DesignIngester:
             "errors": 0,
             "previews_generated": 0,
         }
-
-    def compute_content_hash(self, file_path: Path) -> str:
-        """Compute SHA-256 hash of file contents."""
-        sha256 = hashlib.sha256()
-        with open(file_path, "rb") as f:
-            for chunk in iter(lambda: f.read(8192), b""):
-                sha256.update(chunk)
-        return sha256.hexdigest()
-
-    def compute_phash(self, image_path: Path) -> Optional[str]:
-        """Compute perceptual hash of an image."""
-        try:
-            img = Image.open(image_path)
-            phash = imagehash.phash(img)
-            return str(phash)
-        except Exception as e:
-            print(f"  Warning: Could not compute phash: {e}")
-            return None
-
-    def find_preview_for_design(self, design_path: Path) -> Optional[Path]:
-        """Find an existing preview image for a design file."""
-        stem = design_path.stem
-        parent = design_path.parent
-
-        # Check various naming conventions
-        for ext in PREVIEW_EXTENSIONS:
-            # Same name with image extension
-            preview_path = parent / f"{stem}{ext}"
-            if preview_path.exists():
-                return preview_path
-
-            # With _preview suffix
-            preview_path = parent / f"{stem}_preview{ext}"
-            if preview_path.exists():
-                return preview_path
-
-            # With -preview suffix
-            preview_path = parent / f"{stem}-preview{ext}"
-            if preview_path.exists():
-                return preview_path
-
-            # In a previews subdirectory
-            preview_path = parent / "previews" / f"{stem}{ext}"
-            if preview_path.exists():
-                return preview_path
-
-        return None
-
-    def generate_svg_preview(self, svg_path: Path, output_path: Path) -> bool:
-        """Generate PNG preview from SVG file."""
-        if not HAS_CAIROSVG:
-            return False
-
+        # Reason: the pipeline stages run on worker threads, so the stats
+        # counters need explicit locking.
+        self._stats_lock = threading.Lock()
+
+        # Latest design_files row per source path, loaded in bulk by scan_directory
+        self._existing_by_path: dict[str, dict] = {}
+
+    def _bump(self, key: str) -> None:
+        """Increment a stats counter from any worker thread."""
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    def fill_phashes(self, design_files: list[DesignFile]) -> None:
+        """Set `phash` on prepared files from their phash inputs in one batch."""
+        pending = [d for d in design_files if d.phash_input is not None]
+        for design_file, phash in zip(
+            pending, compute_phashes_batch([d.phash_input for d in pending])
+        ):
+            design_file.phash = phash
+            design_file.phash_input = None
+
+    async def get_ai_metadata_async(
+        self,
+        client: AsyncOpenAI,
+        design_file: DesignFile,
+    ) -> None:
+        """Fill in `metadata` for a prepared design with an async AI request."""
+        filename = design_file.path.name
         try:
-            # Convert SVG to PNG
-            cairosvg.svg2png(
-                url=str(svg_path),
-                write_to=str(output_path),
-                output_width=PREVIEW_MAX_SIZE[0],
-                output_height=PREVIEW_MAX_SIZE[1],
+            response = await client.chat.completions.create(
+                **build_ai_request(design_file.preview, filename, AI_MODEL)
             )
-
-            # Optimize the output
-            img = Image.open(output_path)
-            img.thumbnail(PREVIEW_MAX_SIZE, Image.Resampling.LANCZOS)
-
-            # Convert to RGB if necessary (for JPEG compatibility)
-            if img.mode in ('RGBA', 'P'):
-                background = Image.new('RGB', img.size, (255, 255, 255))
-                if img.mode == 'RGBA':
-                    background.paste(img, mask=img.split()[3])
-                else:
-                    background.paste(img)
-                img = background
-
-            img.save(output_path, 'PNG', optimize=True)
-            return True
-        except Exception as e:
-            print(f"  Warning: SVG preview generation failed: {e}")
-            return False
-
-    def generate_dxf_preview(self, dxf_path: Path, output_path: Path) -> bool:
-        """Generate PNG preview from DXF file."""
-        if not HAS_EZDXF:
-            return False
-
-        try:
-            doc = ezdxf.readfile(str(dxf_path))
-            msp = doc.modelspace()
-
-            fig = plt.figure()
-            ax = fig.add_axes([0, 0, 1, 1])
-            ctx = dxf_matplotlib.RenderContext(doc)
-            out = dxf_matplotlib.MatplotlibBackend(ax)
-            dxf_matplotlib.Frontend(ctx, out).draw_layout(msp)
-
-            ax.set_aspect('equal')
-            ax.axis('off')
-
-            fig.savefig(
-                str(output_path),
-                dpi=150,
-                bbox_inches='tight',
-                pad_inches=0.1,
-                facecolor='white'
+            design_file.metadata = parse_ai_response(
+                response.choices[0].message.content, filename
             )
-            plt.close(fig)
-
-            # Resize to target size
-            img = Image.open(output_path)
-            img.thumbnail(PREVIEW_MAX_SIZE, Image.Resampling.LANCZOS)
-            img.save(output_path, 'PNG', optimize=True)
-
-            return True
         except Exception as e:
-            print(f"  Warning: DXF preview generation failed: {e}")
-            return False
-
-    def generate_preview(self, design_path: Path, output_path: Path) -> bool:
-        """Generate a preview image for a design file."""
-        suffix = design_path.suffix.lower()
-
-        if suffix == '.svg':
-            result = self.generate_svg_preview(design_path, output_path)
-            if result:
-                self.stats["previews_generated"] += 1
-            return result
-        elif suffix == '.dxf':
-            result = self.generate_dxf_preview(design_path, output_path)
-            if result:
-                self.stats["previews_generated"] += 1
-            return result
-        else:
-            # For other formats (AI, EPS, PDF), we'd need additional tools
-            # like ImageMagick/Ghostscript
-            print(f"  Note: Preview generation not implemented for {suffix}")
-            return False
-
-    def get_ai_metadata(self, preview_path: Path, filename: str) -> Optional[AIMetadata]:
-        """Use AI vision to extract metadata from the design preview."""
-        if not self.openai:
-            print("  Warning: OpenAI not configured, using basic metadata")
-            return self._generate_basic_metadata(filename)
+            logger.warning("AI metadata extraction failed for %s: %s", filename, e)
+            design_file.metadata = basic_metadata(filename)
 
-        try:
-            # Read and encode image
-            import base64
-            with open(preview_path, "rb") as f:
-                image_data = base64.b64encode(f.read()).decode("utf-8")
-
-            # Determine mime type
-            ext = preview_path.suffix.lower()
-            mime_type = {
-                ".png": "image/png",
-                ".jpg": "image/jpeg",
-                ".jpeg": "image/jpeg",
-                ".webp": "image/webp",
-            }.get(ext, "image/png")
-
-            response = self.openai.chat.completions.create(
-                model=AI_MODEL,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": """You are analyzing CNC/laser cutting design files.
-                        Extract metadata and return valid JSON with these fields:
-                        - title: A descriptive title (without file extension)
-                        - description: 2-3 sentence description of the design
-                        - project_type: One of: coaster, sign, ornament, box, puzzle, jig, art, other
-                        - difficulty: One of: easy, medium, hard
-                        - materials: Array of suitable materials (wood, acrylic, leather, paper, metal)
-                        - categories: Array of categories
-                        - style: Design style (mandala, geometric, floral, minimal, detailed, celtic, tribal, etc.)
-                        - tags: Array of descriptive tags (max 10)
-                        - approx_dimensions: Estimated dimensions if visible (e.g., "4 inch diameter")
-
-                        Return ONLY valid JSON, no markdown or explanation."""
-                    },
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": f"Analyze this CNC/laser design. Filename: {filename}"
-                            },
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:{mime_type};base64,{image_data}"
-                                }
-                            }
-                        ]
-                    }
-                ],
-                max_completion_tokens=500,
-            )
+    def prepare_file(
+        self,
+        file_path: Path,
+        base_dir: Path,
+        content_hash: str,
+        file_stat: os.stat_result,
+    ) -> DesignFile:
+        """Resolve a file's version history and preview ahead of ingestion.
+
+        The file has already been hashed, counted and checked for exact
+        duplicates by the scan prefilter. `file_stat` is the stat taken
+        before hashing, so the size and mtime recorded always match
+        `content_hash` even if the file changes while it waits its turn.
+        """
+        relative_path = str(file_path.relative_to(base_dir))
 
-            content = response.choices[0].message.content
-            # Clean up response (remove markdown code blocks if present)
-            content = re.sub(r"```json\s*", "", content)
-            content = re.sub(r"```\s*", "", content)
-
-            data = json.loads(content)
-
-            return AIMetadata(
-                title=data.get("title", filename),
-                description=data.get("description", ""),
-                project_type=data.get("project_type"),
-                difficulty=data.get("difficulty"),
-                materials=data.get("materials", []),
-                categories=data.get("categories", []),
-                style=data.get("style"),
-                tags=data.get("tags", []),
-                approx_dimensions=data.get("approx_dimensions"),
-            )
+        logger.info("Processing: %s", relative_path)
 
-        except Exception as e:
-            print(f"  Warning: AI metadata extraction failed: {e}")
-            return self._generate_basic_metadata(filename)
-
-    def _generate_basic_metadata(self, filename: str) -> AIMetadata:
-        """Generate basic metadata from filename."""
-        # Clean up filename for title
-        name = Path(filename).stem
-        title = name.replace("-", " ").replace("_", " ").title()
-
-        return AIMetadata(
-            title=title,
-            description="",
-            project_type=None,
-            difficulty=None,
-            materials=[],
-            categories=[],
-            style=None,
-            tags=[],
-            approx_dimensions=None,
+        design_file = DesignFile(
+            path=file_path,
+            content_hash=content_hash,
+            size_bytes=file_stat.st_size,
+            file_type=file_path.suffix.lower().lstrip("."),
+            relative_path=relative_path,
+            mtime_ns=file_stat.st_mtime_ns,
         )
 
-    def slugify(self, text: str) -> str:
-        """Convert text to URL-friendly slug."""
-        slug = text.lower()
-        slug = re.sub(r"[^\w\s-]", "", slug)
-        slug = re.sub(r"[\s_-]+", "-", slug)
-        slug = slug.strip("-")
-        return slug
-
-    def check_duplicate(self, content_hash: str) -> Optional[dict]:
-        """Check if a file with this hash already exists."""
-        result = self.supabase.table("design_files").select(
-            "id, design_id, version_number"
-        ).eq("content_hash", content_hash).execute()
-
-        if result.data:
-            return result.data[0]
-        return None
-
-    def find_by_source_path(self, source_path: str) -> Optional[dict]:
-        """Find existing design file by source path."""
-        result = self.supabase.table("design_files").select(
-            "id, design_id, content_hash, version_number"
-        ).eq("source_path", source_path).order(
-            "version_number", desc=True
-        ).limit(1).execute()
-
-        if result.data:
-            return result.data[0]
-        return None
-
-    def upload_file(self, local_path: Path, bucket: str, remote_path: str) -> str:
-        """Upload a file to Supabase Storage."""
-        with open(local_path, "rb") as f:
-            self.supabase.storage.from_(bucket).upload(
-                remote_path,
-                f.read(),
-                {"upsert": "true"}
-            )
-        return remote_path
-
-    def create_design(
-        self,
-        metadata: AIMetadata,
-        preview_path: str,
-    ) -> str:
-        """Create a new design record."""
-        slug = self.slugify(metadata.title)
-
-        # Ensure unique slug
-        existing = self.supabase.table("designs").select("id").eq("slug", slug).execute()
-        if existing.data:
-            slug = f"{slug}-{int(datetime.now().timestamp())}"
-
-        result = self.supabase.table("designs").insert({
-            "slug": slug,
-            "title": metadata.title,
-            "description": metadata.description,
-            "preview_path": preview_path,
-            "project_type": metadata.project_type,
-            "difficulty": metadata.difficulty,
-            "materials": metadata.materials,
-            "categories": metadata.categories,
-            "style": metadata.style,
-            "approx_dimensions": metadata.approx_dimensions,
-            "metadata_json": {
-                "ai_generated": True,
-                "tags": metadata.tags,
-            },
-            "is_public": True,
-        }).execute()
-
-        design_id = result.data[0]["id"]
-
-        # Create tags and link them
-        self._link_tags(design_id, metadata.tags)
-
-        return design_id
-
-    def _link_tags(self, design_id: str, tag_names: list[str]) -> None:
-        """Create tags if needed and link them to design."""
-        for tag_name in tag_names:
-            tag_name = tag_name.lower().strip()
-            if not tag_name:
-                continue
+        # Check for existing file by source path (potential new version)
+        design_file.existing = self._existing_by_path.get(relative_path)
 
-            # Get or create tag
-            existing = self.supabase.table("tags").select("id").eq("name", tag_name).execute()
+        # Find or generate preview, keeping the small image its perceptual
+        # hash is computed from (see fill_phashes)
+        preview = self.previews.find_preview_for_design(file_path)
 
-            if existing.data:
-                tag_id = existing.data[0]["id"]
+        if preview:
+            design_file.preview = preview
+            design_file.phash_input = self.previews.load_phash_input(preview)
+        else:
+            # Generated previews stay in memory and are uploaded straight from bytes
+            image = self.previews.generate_preview(file_path)
+            if image:
+                self._bump("previews_generated")
+                design_file.phash_input = phash_input(image)
+                design_file.preview = self.previews.encode_preview(image)
+                logger.info("Generated preview for %s", relative_path)
             else:
-                result = self.supabase.table("tags").insert({"name": tag_name}).execute()
-                tag_id = result.data[0]["id"]
+                logger.warning("No preview available for %s", relative_path)
 
-            # Link tag to design
-            try:
-                self.supabase.table("design_tags").insert({
-                    "design_id": design_id,
-                    "tag_id": tag_id,
-                }).execute()
-            except Exception:
-                pass  # Ignore duplicate links
-
-    def create_design_file(
-        self,
-        design_id: str,
-        storage_path: str,
-        file_type: str,
-        size_bytes: int,
-        content_hash: str,
-        preview_phash: Optional[str],
-        source_path: str,
-        version_number: int,
-    ) -> str:
-        """Create a new design file record."""
-        result = self.supabase.table("design_files").insert({
-            "design_id": design_id,
-            "storage_path": storage_path,
-            "file_type": file_type,
-            "size_bytes": size_bytes,
-            "content_hash": content_hash,
-            "preview_phash": preview_phash,
-            "source_path": source_path,
-            "version_number": version_number,
-            "is_active": True,
-        }).execute()
-
-        return result.data[0]["id"]
-
-    def update_current_version(self, design_id: str, file_id: str) -> None:
-        """Update the design's current version pointer."""
-        # Deactivate old versions
-        self.supabase.table("design_files").update({
-            "is_active": False
-        }).eq("design_id", design_id).neq("id", file_id).execute()
-
-        # Set current version
-        self.supabase.table("designs").update({
-            "current_version_id": file_id,
-            "updated_at": datetime.now().isoformat(),
-        }).eq("id", design_id).execute()
-
-    def process_file(self, file_path: Path, base_dir: Path) -> None:
-        """Process a single design file."""
-        self.stats["scanned"] += 1
-        relative_path = str(file_path.relative_to(base_dir))
+        return design_file
 
-        print(f"\nProcessing: {relative_path}")
+    def ingest_file(self, design_file: DesignFile) -> None:
+        """Upload a prepared file and create its design/version records.
 
-        # Compute content hash
-        content_hash = self.compute_content_hash(file_path)
-        file_size = file_path.stat().st_size
-        file_type = file_path.suffix.lower().lstrip(".")
-
-        # Check for exact duplicate
-        duplicate = self.check_duplicate(content_hash)
-        if duplicate:
-            print(f"  Skipped: Exact duplicate (design {duplicate['design_id']})")
-            self.stats["skipped_duplicate"] += 1
-            return
-
-        # Check for existing file by source path (potential new version)
-        existing = self.find_by_source_path(relative_path)
-
-        # Find or generate preview
-        preview_path = self.find_preview_for_design(file_path)
-        temp_preview = None
-
-        if not preview_path:
-            # Try to generate preview
-            temp_preview = Path(tempfile.mktemp(suffix='.png'))
-            if self.generate_preview(file_path, temp_preview):
-                preview_path = temp_preview
-                print(f"  Generated preview")
-            else:
-                print(f"  Warning: No preview available")
-
-        # Compute perceptual hash if we have a preview
-        phash = None
-        if preview_path and preview_path.exists():
-            phash = self.compute_phash(preview_path)
+        Uses `design_file.metadata` when fetched, otherwise filename-based metadata.
+        """
+        file_path = design_file.path
+        existing = design_file.existing
+        preview = design_file.preview
 
         if existing:
             # New version of existing design
-            print(f"  Creating new version (was v{existing['version_number']})")
+            logger.info(
+                "Creating new version of %s (was v%s)",
+                design_file.relative_path, existing["version_number"],
+            )
 
             design_id = existing["design_id"]
             version_number = existing["version_number"] + 1
 
             # Upload file
             storage_path = f"files/{design_id}/v{version_number}{file_path.suffix}"
-            self.upload_file(file_path, "designs", storage_path)
+            self.store.upload_file(file_path, "designs", storage_path)
 
             # Create file record
-            file_id = self.create_design_file(
+            file_id = self.store.create_design_file(
                 design_id=design_id,
                 storage_path=storage_path,
-                file_type=file_type,
-                size_bytes=file_size,
-                content_hash=content_hash,
-                preview_phash=phash,
-                source_path=relative_path,
+                file_type=design_file.file_type,
+                size_bytes=design_file.size_bytes,
+                content_hash=design_file.content_hash,
+                preview_phash=design_file.phash,
+                source_path=design_file.relative_path,
                 version_number=version_number,
             )
 
             # Update current version
-            self.update_current_version(design_id, file_id)
+            self.store.update_current_version(design_id, file_id)
 
-            print(f"  Created version {version_number}")
-            self.stats["new_versions"] += 1
+            logger.info("Created version %s of %s", version_number, design_file.relative_path)
+            self._bump("new_versions")
+            self._remember(design_file, design_id)
 
         else:
             # Brand new design
-            print(f"  Creating new design")
+            logger.info("Creating new design for %s", design_file.relative_path)
 
             # Get AI metadata
-            metadata = None
-            if preview_path and preview_path.exists():
-                metadata = self.get_ai_metadata(preview_path, file_path.name)
-            else:
-                metadata = self._generate_basic_metadata(file_path.name)
+            # (the enrich stage fetched it unless AI is off or there's no preview)
+            metadata = design_file.metadata or basic_metadata(file_path.name)
 
             # Upload preview if available
             preview_storage_path = ""
-            if preview_path and preview_path.exists():
-                preview_remote = f"{self.slugify(metadata.title)}-{content_hash[:8]}.png"
-                self.upload_file(preview_path, "previews", preview_remote)
+            if preview:
+                preview_remote = f"{self.store.slugify(metadata.title)}-{design_file.content_hash[:8]}.png"
+                if isinstance(preview, bytes):
+                    self.store.upload_bytes(preview, "previews", preview_remote)
+                else:
+                    self.store.upload_file(preview, "previews", preview_remote)
                 # Make it a full URL for public access
                 preview_storage_path = f"{SUPABASE_URL}/storage/v1/object/public/previews/{preview_remote}"
 
             # Create design
-            design_id = self.create_design(metadata, preview_storage_path)
+            design_id = self.store.create_design(
+                metadata, preview_storage_path, design_file.content_hash
+            )
 
             # Upload design file
             storage_path = f"files/{design_id}/v1{file_path.suffix}"
-            self.upload_file(file_path, "designs", storage_path)
+            self.store.upload_file(file_path, "designs", storage_path)
 
             # Create file record
-            file_id = self.create_design_file(
+            file_id = self.store.create_design_file(
                 design_id=design_id,
                 storage_path=storage_path,
-                file_type=file_type,
-                size_bytes=file_size,
-                content_hash=content_hash,
-                preview_phash=phash,
-                source_path=relative_path,
+                file_type=design_file.file_type,
+                size_bytes=design_file.size_bytes,
+                content_hash=design_file.content_hash,
+                preview_phash=design_file.phash,
+                source_path=design_file.relative_path,
                 version_number=1,
             )
 
             # Set current version
-            self.update_current_version(design_id, file_id)
-
-            print(f"  Created: {metadata.title}")
-            self.stats["new_designs"] += 1
-
-        # Clean up temp preview
-        if temp_preview and temp_preview.exists():
-            temp_preview.unlink()
+            self.store.update_current_version(design_id, file_id)
+
+            logger.info("Created %r from %s", metadata.title, design_file.relative_path)
+            self._bump("new_designs")
+            self._remember(design_file, design_id)
+
+    def _remember(self, design_file: DesignFile, design_id: str) -> None:
+        """Record an ingested file so later runs can skip it without hashing."""
+        if self.seen:
+            self.seen.put_many([(
+                str(design_file.path.absolute()),
+                design_file.mtime_ns,
+                design_file.size_bytes,
+                design_file.content_hash,
+                design_id,
+            )])
 
     def scan_directory(self, directory: Path) -> None:
         """Scan a directory for design files."""
-        print(f"Scanning: {directory}")
+        tqdm.write(f"Scanning: {directory}")
 
         # Find all design files
-        design_files = []
-        for ext in SUPPORTED_EXTENSIONS:
-            design_files.extend(directory.rglob(f"*{ext}"))
-            design_files.extend(directory.rglob(f"*{ext.upper()}"))
-
-        # Deduplicate (case-insensitive filesystems)
-        seen = set()
-        unique_files = []
-        for f in design_files:
-            key = str(f).lower()
-            if key not in seen:
-                seen.add(key)
-                unique_files.append(f)
-
-        design_files = sorted(unique_files)
-        print(f"Found {len(design_files)} design files")
-
-        # Process each file
-        for file_path in tqdm(design_files, desc="Processing"):
+        design_files = sorted(walk_design_files(
+            directory, lambda path, e: logger.warning("Could not read %s: %s", path, e)
+        ))
+        tqdm.write(f"Found {len(design_files)} design files")
+
+        # Phase 1: hash everything and drop exact duplicates before any
+        # preview/AI/upload work is spent on them
+        new_files = self._prefilter_duplicates(design_files)
+        tqdm.write(f"{len(new_files)} new or changed files to ingest")
+
+        # Load version history for every survivor up front instead of one query per file
+        lookup_failed: set[str] = set()
+
+        def lookup_failed_for(source_path: str, e: Exception) -> None:
+            logger.error("Error looking up versions of %s: %s", source_path, e)
+            self._bump("errors")
+            lookup_failed.add(source_path)
+
+        self._existing_by_path = self.store.find_by_source_paths(
+            [str(path.relative_to(directory)) for path, *_ in new_files], lookup_failed_for
+        )
+        # Without its version history a file could be ingested as a second design
+        new_files = [
+            item for item in new_files
+            if str(item[0].relative_to(directory)) not in lookup_failed
+        ]
+
+        # Phase 2: full processing for the survivors
+        self._run_pipeline(new_files, directory)
+
+    def _run_pipeline(
+        self, new_files: list[tuple[Path, str, os.stat_result]], directory: Path
+    ) -> None:
+        """Run the survivors through the prepare -> enrich -> ingest pipeline."""
+        if not OPENAI_API_KEY:
+            logger.warning("OpenAI not configured, using basic metadata for new designs")
+        IngestPipeline(
+            self,
+            preview_workers=PREVIEW_WORKERS,
+            ingest_workers=INGEST_WORKERS,
+            ai_concurrency=AI_CONCURRENCY,
+            phash_batch_size=PHASH_BATCH_SIZE,
+            ai_client=(lambda: AsyncOpenAI(api_key=OPENAI_API_KEY)) if OPENAI_API_KEY else None,
+        ).run(new_files, directory)
+
+    def _prefilter_duplicates(
+        self, design_files: list[Path]
+    ) -> list[tuple[Path, str, os.stat_result]]:
+        """Hash files and return (path, hash, stat) for those not already in the library."""
+        # Files unchanged since an earlier run reuse its hash; those it already
+        # ingested are skipped without rehashing or asking Supabase
+        cached: dict[Path, str] = {}
+        file_stats: dict[Path, os.stat_result] = {}
+        to_hash = []
+        for path in design_files:
             try:
-                self.process_file(file_path, directory)
-            except Exception as e:
-                print(f"  Error processing {file_path}: {e}")
-                self.stats["errors"] += 1
+                file_stats[path] = path.stat()
+            except OSError as e:
+                logger.error("Error hashing %s: %s", path, e)
+                self._bump("errors")
+                continue
+
+            hit = None
+            if self.seen:
+                hit = self.seen.get(
+                    str(path.absolute()),
+                    file_stats[path].st_mtime_ns,
+                    file_stats[path].st_size,
+                )
+            if hit and hit[1]:
+                self.stats["scanned"] += 1
+                self.stats["skipped_duplicate"] += 1
+            elif hit:
+                cached[path] = hit[0]
+            else:
+                to_hash.append(path)
+
+        def hash_failed(path: Path, e: OSError) -> None:
+            logger.error("Error hashing %s: %s", path, e)
+            self._bump("errors")
+
+        hashes = dict(zip(to_hash, compute_content_hashes_batch(
+            to_hash,
+            [file_stats[path].st_size for path in to_hash],
+            HASH_WORKERS,
+            hash_failed,
+        )))
+        hashes.update(cached)
+        hashed = [
+            (path, hashes[path]) for path in design_files
+            if hashes.get(path) is not None
+        ]
+        self.stats["scanned"] += len(hashed)
+
+        existing = self.store.find_duplicates(list({h for _, h in hashed}))
+
+        new_files = []
+        seen_hashes = set()
+        cache_rows = []
+        for path, content_hash in hashed:
+            duplicate = existing.get(content_hash)
+            if path not in cached or duplicate:
+                cache_rows.append((
+                    str(path.absolute()),
+                    file_stats[path].st_mtime_ns,
+                    file_stats[path].st_size,
+                    content_hash,
+                    duplicate["design_id"] if duplicate else None,
+                ))
+
+            # Identical copies within this run are duplicates of the first one
+            if duplicate or content_hash in seen_hashes:
+                self.stats["skipped_duplicate"] += 1
+                continue
+            seen_hashes.add(content_hash)
+            new_files.append((path, content_hash, file_stats[path]))
+
+        if self.seen:
+            self.seen.put_many(cache_rows)
+        return new_files
+
+    def safe_call(self, file_path: Path, func, *args):
+        """Run one processing step for a file, recording (not raising) any error."""
+        try:
+            return func(*args)
+        except Exception as e:
+            logger.error("Error processing %s: %s", file_path, e)
+            self._bump("errors")
+            return None
+
+    def close(self) -> None:
+        """Release the HTTP connection pool and the local seen cache."""
+        self.http.close()
+        if self.seen:
+            self.seen.close()
 
     def print_summary(self) -> None:
         """Print ingestion summary."""
-        print("\n" + "=" * 50)
-        print("INGESTION SUMMARY")
-        print("=" * 50)
-        print(f"Files scanned:       {self.stats['scanned']}")
-        print(f"Duplicates skipped:  {self.stats['skipped_duplicate']}")
-        print(f"New designs:         {self.stats['new_designs']}")
-        print(f"New versions:        {self.stats['new_versions']}")
-        print(f"Previews generated:  {self.stats['previews_generated']}")
-        print(f"Errors:              {self.stats['errors']}")
-        print("=" * 50)
+        tqdm.write("\n" + "=" * 50)
+        tqdm.write("INGESTION SUMMARY")
+        tqdm.write("=" * 50)
+        tqdm.write(f"Files scanned:       {self.stats['scanned']}")
+        tqdm.write(f"Duplicates skipped:  {self.stats['skipped_duplicate']}")
+        tqdm.write(f"New designs:         {self.stats['new_designs']}")
+        tqdm.write(f"New versions:        {self.stats['new_versions']}")
+        tqdm.write(f"Previews generated:  {self.stats['previews_generated']}")
+        tqdm.write(f"Errors:              {self.stats['errors']}")
+        tqdm.write("=" * 50)
 
 
 def main():
@@ -668,9 +493,15 @@ def main():
         print(f"Error: Not a directory: {directory}")
         sys.exit(1)
 
+    listener = setup_logging(LOG_PATH)
     ingester = DesignIngester()
-    ingester.scan_directory(directory)
+    try:
+        ingester.scan_directory(directory)
+    finally:
+        ingester.close()
+        listener.stop()
     ingester.print_summary()
+    print(f"Log: {LOG_PATH}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,108 @@
+"""
+Local file discovery and content hashing for the ingestion script.
+"""
+
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Iterator, Optional
+
+from tqdm import tqdm
+
+# Supported file extensions
+SUPPORTED_EXTENSIONS = {".svg", ".dxf", ".ai", ".eps", ".pdf", ".cdr"}
+
+# Read size for the pre-3.11 hashing fallback (large reads keep SHA-NI busy)
+HASH_CHUNK_SIZE = 1024 * 1024
+# Files up to this size (most SVG/DXF) are hashed from a single read
+SMALL_FILE_SIZE = 1024 * 1024
+
+
+def walk_design_files(directory: Path, on_error: Callable[[str, OSError], None]) -> Iterator[Path]:
+    """Yield design files under `directory` in a single tree walk.
+
+    Unreadable directories are reported to `on_error` and skipped.
+    """
+    # Reason: one scandir pass (file types come from readdir, no extra stat)
+    # replaces an rglob per extension and letter case.
+    pending = [directory]
+    while pending:
+        current = pending.pop()
+        try:
+            with os.scandir(current) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        # previews/ holds auxiliary images, not designs
+                        if entry.name != "previews":
+                            pending.append(entry.path)
+                    elif (
+                        os.path.splitext(entry.name)[1].lower() in SUPPORTED_EXTENSIONS
+                        and entry.is_file()
+                    ):
+                        yield Path(entry.path)
+        except OSError as e:
+            on_error(str(current), e)
+
+
+def compute_content_hash(file_path: Path, size: Optional[int] = None) -> str:
+    """Compute SHA-256 hash of file contents.
+
+    `size` (e.g. from an earlier stat) only picks the read strategy; every
+    path reads to EOF, so a stale value still gives the right hash.
+    """
+    # Unbuffered: reads go straight into hashlib without an extra copy
+    with open(file_path, "rb", buffering=0) as f:
+        if size is None:
+            size = os.fstat(f.fileno()).st_size
+        if size <= SMALL_FILE_SIZE:
+            return hashlib.sha256(f.read()).hexdigest()
+
+        if hasattr(os, "posix_fadvise"):
+            # Ask the kernel for aggressive readahead on this sequential scan;
+            # not worth the extra syscall for files read in one call
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+
+        if hasattr(hashlib, "file_digest"):
+            # Python 3.11+: the read/update loop runs in C
+            return hashlib.file_digest(f, "sha256").hexdigest()
+
+        sha256 = hashlib.sha256()
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            sha256.update(chunk)
+        return sha256.hexdigest()
+
+
+def compute_content_hashes_batch(
+    paths: list[Path],
+    sizes: list[Optional[int]],
+    workers: int,
+    on_error: Callable[[Path, OSError], None],
+) -> list[Optional[str]]:
+    """Hash many files in parallel, returning hashes in input order.
+
+    `sizes` are the caller's already-known file sizes (None if unknown), so
+    no file is stat'ed twice. Files that can't be read are reported to
+    `on_error` and get None.
+    """
+    def safe_hash(i: int) -> Optional[str]:
+        try:
+            return compute_content_hash(paths[i], sizes[i])
+        except OSError as e:
+            on_error(paths[i], e)
+            return None
+
+    # Reason: hashlib releases the GIL while digesting, so a thread pool
+    # keeps every core's SHA-NI unit busy. Submitting the largest files
+    # first stops one big CAD file from finishing alone at the end.
+    order = sorted(range(len(paths)), key=lambda i: sizes[i] or 0, reverse=True)
+
+    hashes: list[Optional[str]] = [None] * len(paths)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(safe_hash, order)
+        # tqdm goes first in the zip so it is exhausted and closes its bar
+        for content_hash, i in zip(tqdm(
+            results, total=len(paths), desc="Hashing", dynamic_ncols=True, mininterval=0.5
+        ), order):
+            hashes[i] = content_hash
+    return hashes
@@ -0,0 +1,58 @@
+"""
+Logging setup for the ingestion script.
+
+Per-file progress goes to a rotating log file; warnings and errors are
+also printed above the tqdm progress bars.
+"""
+
+import logging
+import logging.handlers
+import queue
+from pathlib import Path
+
+from tqdm import tqdm
+
+# Rotate the log file at this size, keeping a few old ones
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT = 3
+
+logger = logging.getLogger("ingest")
+
+
+class TqdmHandler(logging.Handler):
+    """Logging handler that prints above active tqdm progress bars."""
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            tqdm.write(self.format(record))
+        except Exception:
+            self.handleError(record)
+
+
+def setup_logging(log_path: Path) -> logging.handlers.QueueListener:
+    """Route the ingest logger through a queue to `log_path` and the console.
+
+    Worker threads only enqueue records; a single listener thread does the
+    formatting and I/O, so logging never blocks ingestion or redraws tqdm.
+    Call `stop()` on the returned listener to flush it.
+    """
+    log_path.parent.mkdir(parents=True, exist_ok=True)
+    file_handler = logging.handlers.RotatingFileHandler(
+        log_path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8"
+    )
+    file_handler.setFormatter(logging.Formatter(
+        "%(asctime)s %(levelname)s [%(threadName)s] %(message)s"
+    ))
+    console_handler = TqdmHandler(logging.WARNING)
+    console_handler.setFormatter(logging.Formatter("  %(levelname)s: %(message)s"))
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+    listener = logging.handlers.QueueListener(
+        log_queue, file_handler, console_handler, respect_handler_level=True
+    )
+    listener.start()
+    return listener
@@ -0,0 +1,203 @@
+"""
+Staged ingestion pipeline: prepare -> enrich -> ingest over bounded queues.
+
+Every blocking get/put also watches an abort event, so one failed stage
+stops the whole pipeline instead of leaving the others blocked.
+"""
+
+import asyncio
+import contextlib
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Callable, Optional
+
+from tqdm import tqdm
+
+# Marks the end of a pipeline queue
+DONE = object()
+# How often a blocked pipeline stage checks whether the run was aborted
+ABORT_POLL_SECONDS = 0.2
+
+
+def queue_get(q: queue.Queue, abort: threading.Event):
+    """Take the next pipeline item, or `DONE` once the run is aborted."""
+    while not abort.is_set():
+        try:
+            return q.get(timeout=ABORT_POLL_SECONDS)
+        except queue.Empty:
+            pass
+    return DONE
+
+
+def queue_put(q: queue.Queue, item, abort: threading.Event) -> bool:
+    """Hand an item to the next pipeline stage; False if the run was aborted."""
+    while not abort.is_set():
+        try:
+            q.put(item, timeout=ABORT_POLL_SECONDS)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+class IngestPipeline:
+    """Runs an ingester's per-file steps as concurrent pipeline stages.
+
+    `ingester` provides prepare_file, fill_phashes, get_ai_metadata_async,
+    ingest_file and safe_call. `ai_client` creates an async OpenAI client
+    (used as an async context manager), or is None to skip AI metadata.
+    """
+
+    def __init__(
+        self,
+        ingester,
+        preview_workers: int,
+        ingest_workers: int,
+        ai_concurrency: int,
+        phash_batch_size: int,
+        ai_client: Optional[Callable] = None,
+    ):
+        self.ingester = ingester
+        self.preview_workers = preview_workers
+        self.ingest_workers = ingest_workers
+        self.ai_concurrency = ai_concurrency
+        self.phash_batch_size = phash_batch_size
+        self.ai_client = ai_client
+
+    def run(
+        self, new_files: list[tuple[Path, str, os.stat_result]], directory: Path
+    ) -> None:
+        """Prepare, enrich and ingest files through bounded pipeline stages.
+
+        prepare (preview rendering, `preview_workers` threads) -> enrich (batched
+        pHash + async AI metadata, `ai_concurrency` in flight) -> ingest (uploads
+        and DB writes, `ingest_workers` threads). Every stage runs at once, so
+        throughput is set by the slowest stage rather than the sum of all.
+        """
+        ingester = self.ingester
+        # Bounded queues apply backpressure and cap the previews held in memory
+        files_q: queue.Queue = queue.Queue(maxsize=self.preview_workers * 2)
+        prepared_q: queue.Queue = queue.Queue(maxsize=self.preview_workers * 2)
+        ingest_q: queue.Queue = queue.Queue(maxsize=self.ingest_workers * 2)
+        progress = tqdm(
+            total=len(new_files), desc="Processing", dynamic_ncols=True, mininterval=0.5
+        )
+        # Reason: set when any stage dies so the others stop instead of blocking
+        # forever on a queue that nobody drains or fills anymore.
+        abort = threading.Event()
+
+        def stage(func, *args) -> None:
+            try:
+                func(*args)
+            except BaseException:
+                abort.set()
+                raise
+
+        def prepare_worker() -> None:
+            while (item := queue_get(files_q, abort)) is not DONE:
+                design_file = ingester.safe_call(
+                    item[0], ingester.prepare_file, item[0], directory, *item[1:]
+                )
+                if design_file is None:
+                    # Preparing failed; safe_call already recorded the error
+                    progress.update()
+                elif not queue_put(prepared_q, design_file, abort):
+                    return
+
+        def ingest_worker() -> None:
+            while (design_file := queue_get(ingest_q, abort)) is not DONE:
+                ingester.safe_call(design_file.path, ingester.ingest_file, design_file)
+                progress.update()
+
+        workers = self.preview_workers + self.ingest_workers + 1
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                ingesters = [
+                    executor.submit(stage, ingest_worker) for _ in range(self.ingest_workers)
+                ]
+                enricher = executor.submit(
+                    stage, asyncio.run, self._enrich_stage(prepared_q, ingest_q, abort)
+                )
+                preparers = [
+                    executor.submit(stage, prepare_worker) for _ in range(self.preview_workers)
+                ]
+
+                try:
+                    for item in new_files:
+                        if not queue_put(files_q, item, abort):
+                            break
+                except BaseException:
+                    abort.set()
+                    raise
+                finally:
+                    # Shut each stage down once everything upstream of it is finished
+                    for _ in preparers:
+                        queue_put(files_q, DONE, abort)
+                    wait(preparers)
+                    queue_put(prepared_q, DONE, abort)
+                    wait([enricher])
+                    for _ in ingesters:
+                        queue_put(ingest_q, DONE, abort)
+        finally:
+            progress.close()
+
+        # Surface the first stage failure instead of ending the run silently
+        for future in [*preparers, enricher, *ingesters]:
+            future.result()
+
+    async def _enrich_stage(
+        self,
+        prepared_q: queue.Queue,
+        ingest_q: queue.Queue,
+        abort: threading.Event,
+    ) -> None:
+        """Pipeline stage: batch pHashes, then fetch AI metadata for new designs."""
+        ingester = self.ingester
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(self.ai_concurrency)
+        tasks: set[asyncio.Task] = set()
+
+        async def enrich(client, design_file) -> None:
+            # Reason: hold the slot until ingest_q accepts the result, so a slow
+            # ingest stage stalls new AI requests instead of piling finished
+            # results up in executor threads; ai_concurrency bounds both.
+            try:
+                await ingester.get_ai_metadata_async(client, design_file)
+                await loop.run_in_executor(None, queue_put, ingest_q, design_file, abort)
+            finally:
+                semaphore.release()
+
+        # Reason: the AsyncOpenAI client is bound to this stage's event loop
+        client_context = self.ai_client() if self.ai_client else contextlib.nullcontext()
+        async with client_context as client:
+            done = False
+            while not done:
+                # Block for the next file, then take whatever else is ready so
+                # its pHash is computed in the same batched DCT
+                batch = [await loop.run_in_executor(None, queue_get, prepared_q, abort)]
+                while len(batch) < self.phash_batch_size and batch[-1] is not DONE:
+                    try:
+                        batch.append(prepared_q.get_nowait())
+                    except queue.Empty:
+                        break
+                if batch[-1] is DONE:
+                    done = True
+                    batch.pop()
+
+                ingester.fill_phashes(batch)
+                for design_file in batch:
+                    # Only brand-new designs with a preview need AI metadata
+                    if client and not design_file.existing and design_file.preview:
+                        await semaphore.acquire()
+                        task = asyncio.create_task(enrich(client, design_file))
+                        tasks.add(task)
+                        task.add_done_callback(tasks.discard)
+                    elif not await loop.run_in_executor(
+                        None, queue_put, ingest_q, design_file, abort
+                    ):
+                        return
+
+            await asyncio.gather(*tasks)
@@ -0,0 +1,232 @@
+"""
+Preview discovery and rendering for the ingestion script.
+
+SVGs are rasterized with cairosvg; DXFs go through ezdxf's SVG backend
+(or matplotlib when cairosvg is unavailable).
+"""
+
+import logging
+import threading
+from io import BytesIO
+from pathlib import Path
+from typing import Optional
+
+from PIL import Image
+
+from ingest_phash import PHASH_INPUT_SIZE, phash_input
+
+# Optional imports for preview generation
+try:
+    import cairosvg
+    HAS_CAIROSVG = True
+except (ImportError, OSError):
+    # OSError: cairosvg is installed but the native libcairo is missing
+    HAS_CAIROSVG = False
+    print("Warning: cairosvg not available. SVG preview generation disabled.")
+
+try:
+    import ezdxf
+    from ezdxf.addons.drawing import Frontend, RenderContext, layout, svg as dxf_svg
+    from ezdxf.addons.drawing.config import BackgroundPolicy, ColorPolicy, Configuration
+    HAS_EZDXF = True
+except ImportError:
+    HAS_EZDXF = False
+    print("Warning: ezdxf not installed. DXF preview generation disabled.")
+
+# matplotlib is only needed to render DXF previews when cairosvg is unavailable
+try:
+    from ezdxf.addons.drawing import matplotlib as dxf_matplotlib
+    import matplotlib.pyplot as plt
+    HAS_MATPLOTLIB = True
+except ImportError:
+    HAS_MATPLOTLIB = False
+    if HAS_EZDXF and not HAS_CAIROSVG:
+        print("Warning: cairosvg/matplotlib not installed. DXF preview generation disabled.")
+
+logger = logging.getLogger("ingest")
+
+PREVIEW_EXTENSIONS = {".png", ".jpg", ".jpeg", ".webp"}
+
+# Preview settings
+PREVIEW_MAX_SIZE = (800, 800)
+PREVIEW_QUALITY = 85
+
+
+def resample_filter(name: str) -> Image.Resampling:
+    """Look up a Pillow resampling filter by name, case-insensitively."""
+    try:
+        return Image.Resampling[name.strip().upper()]
+    except KeyError:
+        allowed = ", ".join(f.name for f in Image.Resampling)
+        raise ValueError(
+            f"Invalid PREVIEW_RESAMPLE {name!r}; expected one of: {allowed}"
+        ) from None
+
+
+class PreviewRenderer:
+    """Finds existing previews and renders missing ones in memory."""
+
+    def __init__(self, resample: Image.Resampling):
+        self.resample = resample
+
+        # The matplotlib DXF fallback reuses one Figure instead of allocating per file
+        self._dxf_lock = threading.Lock()
+        self._dxf_fig = None
+        self._dxf_ax = None
+        if HAS_EZDXF and HAS_MATPLOTLIB and not HAS_CAIROSVG:
+            self._dxf_fig = plt.figure()
+            self._dxf_ax = self._dxf_fig.add_axes([0, 0, 1, 1])
+
+    def find_preview_for_design(self, design_path: Path) -> Optional[Path]:
+        """Find an existing preview image for a design file."""
+        stem = design_path.stem
+        parent = design_path.parent
+
+        # Check various naming conventions
+        for ext in PREVIEW_EXTENSIONS:
+            # Same name with image extension
+            preview_path = parent / f"{stem}{ext}"
+            if preview_path.exists():
+                return preview_path
+
+            # With _preview suffix
+            preview_path = parent / f"{stem}_preview{ext}"
+            if preview_path.exists():
+                return preview_path
+
+            # With -preview suffix
+            preview_path = parent / f"{stem}-preview{ext}"
+            if preview_path.exists():
+                return preview_path
+
+            # In a previews subdirectory
+            preview_path = parent / "previews" / f"{stem}{ext}"
+            if preview_path.exists():
+                return preview_path
+
+        return None
+
+    def load_phash_input(self, image_path: Path) -> Optional[Image.Image]:
+        """Load an image file as the 32x32 grayscale input used for its phash."""
+        try:
+            with Image.open(image_path) as img:
+                # JPEGs decode straight to a small grayscale image via libjpeg's
+                # DCT scaling (a no-op for other formats); phash only needs 32x32 "L"
+                img.draft("L", PHASH_INPUT_SIZE)
+                return phash_input(img)
+        except Exception as e:
+            logger.warning("Could not compute phash for %s: %s", image_path, e)
+            return None
+
+    def generate_preview(self, design_path: Path) -> Optional[Image.Image]:
+        """Generate a preview image for a design file."""
+        suffix = design_path.suffix.lower()
+
+        if suffix == '.svg':
+            return self.generate_svg_preview(design_path)
+        elif suffix == '.dxf':
+            return self.generate_dxf_preview(design_path)
+        else:
+            # For other formats (AI, EPS, PDF), we'd need additional tools
+            # like ImageMagick/Ghostscript
+            logger.info("Preview generation not implemented for %s", suffix)
+            return None
+
+    def generate_svg_preview(self, svg_path: Path) -> Optional[Image.Image]:
+        """Generate an in-memory preview image from SVG file."""
+        if not HAS_CAIROSVG:
+            return None
+
+        try:
+            return self._rasterize_svg(url=str(svg_path))
+        except Exception as e:
+            logger.warning("SVG preview generation failed for %s: %s", svg_path, e)
+            return None
+
+    def _rasterize_svg(self, **source) -> Image.Image:
+        """Render SVG (cairosvg `url=` or `bytestring=`) to a white-backed preview."""
+        # Convert SVG to PNG (returned as bytes when write_to is omitted)
+        png_data = cairosvg.svg2png(
+            **source,
+            output_width=PREVIEW_MAX_SIZE[0],
+            output_height=PREVIEW_MAX_SIZE[1],
+        )
+
+        # Optimize the output
+        img = Image.open(BytesIO(png_data))
+        img.thumbnail(PREVIEW_MAX_SIZE, self.resample)
+
+        # Convert to RGB if necessary (for JPEG compatibility)
+        if img.mode in ('RGBA', 'P'):
+            background = Image.new('RGB', img.size, (255, 255, 255))
+            if img.mode == 'RGBA':
+                background.paste(img, mask=img.split()[3])
+            else:
+                background.paste(img)
+            img = background
+
+        return img
+
+    def generate_dxf_preview(self, dxf_path: Path) -> Optional[Image.Image]:
+        """Generate an in-memory preview image from DXF file."""
+        if not HAS_EZDXF or not (HAS_CAIROSVG or HAS_MATPLOTLIB):
+            return None
+
+        try:
+            doc = ezdxf.readfile(str(dxf_path))
+            msp = doc.modelspace()
+
+            if HAS_CAIROSVG:
+                # Reason: ezdxf's SVG backend + cairosvg skips matplotlib's
+                # Figure setup entirely and reuses the SVG preview pipeline.
+                backend = dxf_svg.SVGBackend()
+                config = Configuration(
+                    background_policy=BackgroundPolicy.WHITE,
+                    color_policy=ColorPolicy.BLACK,
+                )
+                Frontend(RenderContext(doc), backend, config=config).draw_layout(msp)
+                # A 0x0 page is sized to the drawing's extents
+                page = layout.Page(0, 0, layout.Units.mm, margins=layout.Margins.all(2))
+                svg_data = backend.get_string(page)
+                return self._rasterize_svg(bytestring=svg_data.encode("utf-8"))
+
+            return self._render_dxf_matplotlib(doc, msp)
+        except Exception as e:
+            logger.warning("DXF preview generation failed for %s: %s", dxf_path, e)
+            return None
+
+    def _render_dxf_matplotlib(self, doc, msp) -> Image.Image:
+        """Fallback DXF renderer for hosts without cairosvg."""
+        # The shared Figure (like pyplot itself) is not thread-safe
+        with self._dxf_lock:
+            fig, ax = self._dxf_fig, self._dxf_ax
+            ax.clear()
+            ctx = RenderContext(doc)
+            out = dxf_matplotlib.MatplotlibBackend(ax)
+            Frontend(ctx, out).draw_layout(msp)
+
+            ax.set_aspect('equal')
+            ax.axis('off')
+
+            buffer = BytesIO()
+            fig.savefig(
+                buffer,
+                format='png',
+                dpi=150,
+                bbox_inches='tight',
+                pad_inches=0.1,
+                facecolor='white'
+            )
+
+        # Resize to target size
+        buffer.seek(0)
+        img = Image.open(buffer)
+        img.thumbnail(PREVIEW_MAX_SIZE, self.resample)
+
+        return img
+
+    def encode_preview(self, img: Image.Image) -> bytes:
+        """Encode a generated preview image as optimized PNG bytes."""
+        buffer = BytesIO()
+        img.save(buffer, 'PNG', optimize=True)
+        return buffer.getvalue()
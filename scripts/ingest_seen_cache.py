@@ -0,0 +1,75 @@
+"""
+Local SQLite cache of files seen by earlier ingestion runs.
+
+Lets re-runs skip unchanged files without rehashing them.
+"""
+
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Optional
+
+# Bump when the table layout changes; older caches are simply rebuilt
+SCHEMA_VERSION = 2
+
+
+class SeenCache:
+    """SQLite record of files hashed or ingested by previous runs.
+
+    Rows are keyed by Supabase instance and absolute path, and only trusted
+    while the file's mtime and size are unchanged. The instance is part of
+    the key because a design_id only means something in the project that
+    issued it; one cache file can serve staging and production runs.
+    """
+
+    def __init__(self, db_path: Path, instance: str):
+        self._instance = instance
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        # One connection shared by the worker threads, serialized by a lock
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            if self._conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+                # Pre-instance caches can't say which project their design_ids are from
+                self._conn.execute("DROP TABLE IF EXISTS files")
+                self._conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS files (
+                    instance TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    content_hash TEXT NOT NULL,
+                    design_id TEXT,
+                    PRIMARY KEY (instance, path)
+                )"""
+            )
+            self._conn.commit()
+
+    def get(self, path: str, mtime_ns: int, size: int) -> Optional[tuple[str, Optional[str]]]:
+        """Return (content_hash, design_id) if the file is unchanged since it was recorded."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT content_hash, design_id FROM files"
+                " WHERE instance = ? AND path = ? AND mtime_ns = ? AND size = ?",
+                (self._instance, path, mtime_ns, size),
+            ).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def put_many(self, rows: list[tuple[str, int, int, str, Optional[str]]]) -> None:
+        """Record (path, mtime_ns, size, content_hash, design_id) rows."""
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                [(self._instance, *row) for row in rows],
+            )
+            self._conn.commit()
+
+    def close(self) -> None:
+        """Close the database connection."""
+        with self._lock:
+            self._conn.close()
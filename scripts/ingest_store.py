@@ -0,0 +1,264 @@
+"""
+Supabase data access for the ingestion script: lookups, uploads and
+design/version/tag records.
+"""
+
+import logging
+import re
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Iterator, Optional
+from urllib.parse import quote
+
+from supabase import Client, PostgrestAPIError
+
+from ingest_ai import AIMetadata
+
+logger = logging.getLogger("ingest")
+
+# Max URL-encoded length of the values in one `.in_()` filter, keeps PostgREST
+# query strings well under common 8 KB request-line limits
+LOOKUP_MAX_CHARS = 4000
+
+# Postgres SQLSTATE for a UNIQUE constraint violation
+UNIQUE_VIOLATION = "23505"
+
+# Patterns used on every design, compiled once
+_SLUG_NONWORD = re.compile(r"[^\w\s-]")
+_SLUG_SEP = re.compile(r"[\s_-]+")
+
+
+def quote_filter_value(value: str) -> str:
+    """Quote a value for a PostgREST `in` list, escaping `"` and `\\`."""
+    # Reason: postgrest-py's in_() quotes values containing ,:() but leaves
+    # embedded quotes unescaped, so a name like `12" sign (v2).svg` broke the
+    # whole list. Quoting every value ourselves is always valid.
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def in_filter(values: list[str]) -> str:
+    """Build the `(...)` criteria of a PostgREST `in` filter."""
+    return "(" + ",".join(quote_filter_value(value) for value in values) + ")"
+
+
+def lookup_batches(values: list[str]) -> Iterator[list[str]]:
+    """Split values into `in` filter batches bounded by LOOKUP_MAX_CHARS."""
+    batch, length = [], 0
+    for value in values:
+        # Reason: measure what goes on the wire. Percent-encoding makes "/"
+        # or "," 3 chars and non-ASCII 6-12, so raw lengths undercount deep
+        # or accented paths. The +3 is the encoded "," separator.
+        size = len(quote(quote_filter_value(value), safe="")) + 3
+        if batch and length + size > LOOKUP_MAX_CHARS:
+            yield batch
+            batch, length = [], 0
+        batch.append(value)
+        length += size
+    if batch:
+        yield batch
+
+
+class DesignStore:
+    """Reads and writes designs, design files and tags in Supabase."""
+
+    def __init__(self, supabase: Client):
+        self.supabase = supabase
+
+        # Tag name -> id, filled as tags are seen so later designs skip the lookup
+        self._tag_ids: dict[str, str] = {}
+        self._tag_lock = threading.Lock()
+
+    def slugify(self, text: str) -> str:
+        """Convert text to URL-friendly slug."""
+        slug = text.lower()
+        slug = _SLUG_NONWORD.sub("", slug)
+        slug = _SLUG_SEP.sub("-", slug)
+        slug = slug.strip("-")
+        return slug
+
+    def find_duplicates(self, content_hashes: list[str]) -> dict[str, dict]:
+        """Look up many content hashes at once, returning existing files by hash."""
+        found: dict[str, dict] = {}
+        for batch in lookup_batches(content_hashes):
+            result = self.supabase.table("design_files").select(
+                "id, design_id, version_number, content_hash"
+            ).filter("content_hash", "in", in_filter(batch)).execute()
+
+            for row in result.data or []:
+                found.setdefault(row["content_hash"], row)
+        return found
+
+    def find_by_source_paths(
+        self,
+        source_paths: list[str],
+        on_error: Callable[[str, Exception], None],
+    ) -> dict[str, dict]:
+        """Find the latest existing design file for each source path.
+
+        If a batch lookup fails its paths are retried one by one; paths that
+        still can't be looked up are reported to `on_error` and left out.
+        """
+        columns = "id, design_id, content_hash, version_number, source_path"
+        rows: list[dict] = []
+        for batch in lookup_batches(source_paths):
+            try:
+                rows.extend(self.supabase.table("design_files").select(columns).filter(
+                    "source_path", "in", in_filter(batch)
+                ).execute().data or [])
+            except Exception as e:
+                logger.warning("Batch source path lookup failed, retrying per file: %s", e)
+                for source_path in batch:
+                    try:
+                        rows.extend(self.supabase.table("design_files").select(columns).eq(
+                            "source_path", source_path
+                        ).execute().data or [])
+                    except Exception as path_error:
+                        on_error(source_path, path_error)
+
+        latest: dict[str, dict] = {}
+        for row in rows:
+            current = latest.get(row["source_path"])
+            if current is None or row["version_number"] > current["version_number"]:
+                latest[row["source_path"]] = row
+        return latest
+
+    def upload_file(self, local_path: Path, bucket: str, remote_path: str) -> str:
+        """Upload a file to Supabase Storage."""
+        # Pass the open file so httpx streams it instead of buffering it whole
+        with open(local_path, "rb") as f:
+            self.supabase.storage.from_(bucket).upload(
+                remote_path,
+                f,
+                {"upsert": "true"}
+            )
+        return remote_path
+
+    def upload_bytes(self, data: bytes, bucket: str, remote_path: str) -> str:
+        """Upload in-memory content to Supabase Storage."""
+        self.supabase.storage.from_(bucket).upload(
+            remote_path,
+            data,
+            {"upsert": "true"}
+        )
+        return remote_path
+
+    def create_design(
+        self,
+        metadata: AIMetadata,
+        preview_path: str,
+        content_hash: str,
+    ) -> str:
+        """Create a new design record."""
+        slug = self.slugify(metadata.title)
+        record = {
+            "title": metadata.title,
+            "description": metadata.description,
+            "preview_path": preview_path,
+            "project_type": metadata.project_type,
+            "difficulty": metadata.difficulty,
+            "materials": metadata.materials,
+            "categories": metadata.categories,
+            "style": metadata.style,
+            "approx_dimensions": metadata.approx_dimensions,
+            "metadata_json": {
+                "ai_generated": True,
+                "tags": metadata.tags,
+            },
+            "is_public": True,
+        }
+
+        # Reason: let the UNIQUE constraint arbitrate instead of check-then-insert
+        # under a lock, so workers never serialize on slug lookups. A taken slug
+        # gets the file's content hash, which is unique per design.
+        candidates = [slug, f"{slug}-{content_hash[:8]}", f"{slug}-{content_hash}"]
+        for candidate in candidates:
+            try:
+                result = self.supabase.table("designs").insert(
+                    {"slug": candidate, **record}
+                ).execute()
+                break
+            except PostgrestAPIError as e:
+                if e.code != UNIQUE_VIOLATION or candidate == candidates[-1]:
+                    raise
+
+        design_id = result.data[0]["id"]
+
+        # Create tags and link them. Tags are also kept in metadata_json, so a
+        # failure here leaves a usable design instead of aborting the file
+        # after its public designs row already exists.
+        try:
+            self._link_tags(design_id, metadata.tags)
+        except Exception as e:
+            logger.warning("Could not link tags for design %s: %s", design_id, e)
+
+        return design_id
+
+    def _link_tags(self, design_id: str, tag_names: list[str]) -> None:
+        """Create tags if needed and link them to design."""
+        # Normalize and dedupe; one upsert batch can't touch the same row twice.
+        # Reason: sorted, so concurrent upserts of overlapping new tags take the
+        # unique-index row locks in the same order and cannot deadlock.
+        names = sorted({name.lower().strip() for name in tag_names if name.strip()})
+        if not names:
+            return
+
+        with self._tag_lock:
+            missing = [name for name in names if name not in self._tag_ids]
+
+        if missing:
+            # Get or create all unknown tags in one round-trip; the merge-duplicates
+            # upsert returns existing rows as well as newly inserted ones
+            result = self.supabase.table("tags").upsert(
+                [{"name": name} for name in missing],
+                on_conflict="name",
+            ).execute()
+            with self._tag_lock:
+                for row in result.data:
+                    self._tag_ids[row["name"]] = row["id"]
+
+        # Link all tags to the design, ignoring links that already exist
+        self.supabase.table("design_tags").upsert(
+            [{"design_id": design_id, "tag_id": self._tag_ids[name]} for name in names],
+            on_conflict="design_id,tag_id",
+            ignore_duplicates=True,
+        ).execute()
+
+    def create_design_file(
+        self,
+        design_id: str,
+        storage_path: str,
+        file_type: str,
+        size_bytes: int,
+        content_hash: str,
+        preview_phash: Optional[str],
+        source_path: str,
+        version_number: int,
+    ) -> str:
+        """Create a new design file record."""
+        result = self.supabase.table("design_files").insert({
+            "design_id": design_id,
+            "storage_path": storage_path,
+            "file_type": file_type,
+            "size_bytes": size_bytes,
+            "content_hash": content_hash,
+            "preview_phash": preview_phash,
+            "source_path": source_path,
+            "version_number": version_number,
+            "is_active": True,
+        }).execute()
+
+        return result.data[0]["id"]
+
+    def update_current_version(self, design_id: str, file_id: str) -> None:
+        """Update the design's current version pointer."""
+        # Deactivate old versions
+        self.supabase.table("design_files").update({
+            "is_active": False
+        }).eq("design_id", design_id).neq("id", file_id).execute()
+
+        # Set current version
+        self.supabase.table("designs").update({
+            "current_version_id": file_id,
+            "updated_at": datetime.now().isoformat(),
+        }).eq("id", design_id).execute()
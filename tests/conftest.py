@@ -0,0 +1,7 @@
+"""Pytest setup for the Python ingestion scripts."""
+
+import sys
+from pathlib import Path
+
+# The ingestion script and its helper modules live in scripts/, not a package
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "scripts"))
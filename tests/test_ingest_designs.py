@@ -0,0 +1,916 @@
+"""Unit tests for the design ingestion script's helpers."""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Optional
+from urllib.parse import quote
+
+import numpy as np
+import pytest
+from PIL import Image
+from pydantic import ValidationError
+from supabase import PostgrestAPIError
+
+import ingest_designs
+from ingest_ai import AI_RESPONSE_FORMAT, AIMetadata, parse_ai_response
+from ingest_files import (
+    SMALL_FILE_SIZE,
+    compute_content_hash,
+    compute_content_hashes_batch,
+    walk_design_files,
+)
+from ingest_phash import PHASH_INPUT_SIZE, compute_phashes_batch
+from ingest_pipeline import IngestPipeline
+from ingest_previews import resample_filter
+from ingest_seen_cache import SeenCache
+from ingest_store import LOOKUP_MAX_CHARS, DesignStore, in_filter, lookup_batches
+
+
+# ---------------------------------------------------------------------------
+# SeenCache
+# ---------------------------------------------------------------------------
+
+STAGING = "https://staging.example.co"
+PRODUCTION = "https://prod.example.co"
+
+
+def test_seen_cache_hit_when_unchanged(tmp_path):
+    cache = SeenCache(tmp_path / "seen.sqlite", STAGING)
+    cache.put_many([("/designs/a.svg", 100, 2048, "abc123", "design-1")])
+
+    assert cache.get("/designs/a.svg", 100, 2048) == ("abc123", "design-1")
+    cache.close()
+
+
+def test_seen_cache_miss_when_mtime_or_size_changes(tmp_path):
+    cache = SeenCache(tmp_path / "seen.sqlite", STAGING)
+    cache.put_many([("/designs/a.svg", 100, 2048, "abc123", "design-1")])
+
+    assert cache.get("/designs/a.svg", 101, 2048) is None
+    assert cache.get("/designs/a.svg", 100, 2049) is None
+    assert cache.get("/designs/b.svg", 100, 2048) is None
+    cache.close()
+
+
+def test_seen_cache_replaces_rows_and_persists(tmp_path):
+    db_path = tmp_path / "nested" / "seen.sqlite"
+    cache = SeenCache(db_path, STAGING)
+    # Hashed but not yet ingested, then recorded again once it was
+    cache.put_many([("/designs/a.svg", 100, 2048, "abc123", None)])
+    cache.put_many([("/designs/a.svg", 100, 2048, "abc123", "design-1")])
+    cache.put_many([])
+    cache.close()
+
+    reopened = SeenCache(db_path, STAGING)
+    assert reopened.get("/designs/a.svg", 100, 2048) == ("abc123", "design-1")
+    reopened.close()
+
+
+def test_seen_cache_keeps_instances_apart(tmp_path):
+    db_path = tmp_path / "seen.sqlite"
+    staging = SeenCache(db_path, STAGING)
+    staging.put_many([("/designs/a.svg", 100, 2048, "abc123", "staging-design")])
+    staging.close()
+
+    production = SeenCache(db_path, PRODUCTION)
+    assert production.get("/designs/a.svg", 100, 2048) is None
+    production.put_many([("/designs/a.svg", 100, 2048, "abc123", "prod-design")])
+    production.close()
+
+    staging = SeenCache(db_path, STAGING)
+    assert staging.get("/designs/a.svg", 100, 2048) == ("abc123", "staging-design")
+    staging.close()
+
+
+def test_seen_cache_rebuilds_pre_instance_cache(tmp_path):
+    db_path = tmp_path / "seen.sqlite"
+    legacy = sqlite3.connect(db_path)
+    legacy.execute(
+        "CREATE TABLE files (path TEXT PRIMARY KEY, mtime_ns INTEGER NOT NULL,"
+        " size INTEGER NOT NULL, content_hash TEXT NOT NULL, design_id TEXT)"
+    )
+    legacy.execute("INSERT INTO files VALUES ('/designs/a.svg', 100, 2048, 'abc123', 'd-1')")
+    legacy.commit()
+    legacy.close()
+
+    cache = SeenCache(db_path, PRODUCTION)
+    # Legacy rows have no instance, so they must not be trusted by any run
+    assert cache.get("/designs/a.svg", 100, 2048) is None
+    cache.put_many([("/designs/a.svg", 100, 2048, "abc123", "d-2")])
+    assert cache.get("/designs/a.svg", 100, 2048) == ("abc123", "d-2")
+    cache.close()
+
+
+# ---------------------------------------------------------------------------
+# AI metadata
+# ---------------------------------------------------------------------------
+
+
+AI_REPLY = {
+    "title": "Celtic Knot Coaster",
+    "description": "An interlaced knot coaster.",
+    "project_type": "coaster",
+    "difficulty": "medium",
+    "materials": ["wood"],
+    "categories": ["kitchen"],
+    "style": "celtic",
+    "tags": ["knot", "coaster"],
+    "approx_dimensions": None,
+}
+
+
+def test_parse_ai_response_accepts_valid_reply():
+    metadata = parse_ai_response(json.dumps(AI_REPLY), "knot.svg")
+
+    assert metadata == AIMetadata(**AI_REPLY)
+
+
+def test_parse_ai_response_falls_back_to_filename_title():
+    reply = {**AI_REPLY, "title": "   "}
+
+    metadata = parse_ai_response(json.dumps(reply), "celtic_knot-coaster.svg")
+
+    assert metadata.title == "Celtic Knot Coaster"
+    assert metadata.tags == AI_REPLY["tags"]
+
+
+@pytest.mark.parametrize("reply", [
+    {**AI_REPLY, "rating": 5},
+    {key: value for key, value in AI_REPLY.items() if key != "style"},
+])
+def test_parse_ai_response_rejects_extra_or_missing_fields(reply):
+    with pytest.raises(ValidationError):
+        parse_ai_response(json.dumps(reply), "knot.svg")
+
+
+def test_ai_response_format_is_strict():
+    json_schema = AI_RESPONSE_FORMAT["json_schema"]
+    schema = json_schema["schema"]
+
+    assert AI_RESPONSE_FORMAT["type"] == "json_schema"
+    assert json_schema["strict"] is True
+    # Strict structured outputs reject schemas with optional or open fields
+    assert schema["additionalProperties"] is False
+    assert sorted(schema["required"]) == sorted(AIMetadata.model_fields)
+
+
+# ---------------------------------------------------------------------------
+# Batched pHash
+# ---------------------------------------------------------------------------
+
+
+def _random_images(count: int, seed: int = 0) -> list[Image.Image]:
+    rng = np.random.default_rng(seed)
+    return [
+        Image.fromarray(rng.integers(0, 256, PHASH_INPUT_SIZE, dtype=np.uint8), "L")
+        for _ in range(count)
+    ]
+
+
+def test_phash_batch_matches_imagehash():
+    imagehash = pytest.importorskip("imagehash")
+    # 32x32 "L" inputs skip both resizes, so the hashes must be bit-identical
+    images = _random_images(64)
+
+    expected = [str(imagehash.phash(img)) for img in images]
+
+    assert compute_phashes_batch(images) == expected
+
+
+def test_phash_batch_handles_flat_and_rgb_images():
+    imagehash = pytest.importorskip("imagehash")
+    flat = Image.new("L", PHASH_INPUT_SIZE, 128)
+    rgb = Image.merge("RGB", _random_images(3, seed=1))
+
+    hashes = compute_phashes_batch([flat, rgb])
+
+    assert hashes[0] == str(imagehash.phash(flat))
+    assert hashes[1] == str(imagehash.phash(rgb.convert("L")))
+    assert all(len(h) == 16 for h in hashes)
+
+
+def test_phash_batch_skips_unreadable_images():
+    images = _random_images(2)
+
+    hashes = compute_phashes_batch([images[0], object(), images[1]])
+
+    assert hashes[1] is None
+    assert hashes[0] == compute_phashes_batch([images[0]])[0]
+    assert hashes[2] == compute_phashes_batch([images[1]])[0]
+    assert compute_phashes_batch([]) == []
+
+
+# ---------------------------------------------------------------------------
+# File discovery
+# ---------------------------------------------------------------------------
+
+
+def _touch(path: Path) -> Path:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"design")
+    return path
+
+
+def _walk(directory: Path, errors: Optional[list] = None) -> list[Path]:
+    on_error = errors.append if errors is not None else lambda *args: None
+    return list(walk_design_files(directory, lambda path, e: on_error((path, e))))
+
+
+def test_walk_finds_supported_files_in_any_case(tmp_path):
+    expected = {
+        _touch(tmp_path / "a.svg"),
+        _touch(tmp_path / "B.DXF"),
+        _touch(tmp_path / "nested" / "deeper" / "c.Pdf"),
+    }
+    _touch(tmp_path / "notes.txt")
+    _touch(tmp_path / "photo.png")
+
+    assert set(_walk(tmp_path)) == expected
+
+
+def test_walk_skips_previews_directory(tmp_path):
+    design = _touch(tmp_path / "a.svg")
+    _touch(tmp_path / "previews" / "a.svg")
+    _touch(tmp_path / "nested" / "previews" / "b.dxf")
+
+    assert _walk(tmp_path) == [design]
+
+
+def test_walk_continues_past_unreadable_directories(tmp_path, monkeypatch):
+    design = _touch(tmp_path / "ok" / "a.svg")
+    locked = tmp_path / "locked"
+    _touch(locked / "b.svg")
+
+    real_scandir = os.scandir
+
+    def scandir(path):
+        # Reason: chmod 000 is ignored when the tests run as root
+        if Path(path) == locked:
+            raise PermissionError(13, "Permission denied", str(path))
+        return real_scandir(path)
+
+    monkeypatch.setattr(os, "scandir", scandir)
+    errors = []
+
+    assert _walk(tmp_path, errors) == [design]
+    assert [path for path, _ in errors] == [str(locked)]
+
+
+def test_walk_of_missing_directory_yields_nothing(tmp_path):
+    errors = []
+
+    assert _walk(tmp_path / "missing", errors) == []
+    assert len(errors) == 1
+
+
+def _write_random(path: Path, size: int, seed: int = 0) -> bytes:
+    data = np.random.default_rng(seed).bytes(size)
+    path.write_bytes(data)
+    return data
+
+
+@pytest.mark.parametrize("size", [0, 1, SMALL_FILE_SIZE, SMALL_FILE_SIZE + 1, 3 * SMALL_FILE_SIZE])
+def test_content_hash_matches_sha256(tmp_path, size):
+    path = tmp_path / "design.dxf"
+    data = _write_random(path, size)
+    expected = hashlib.sha256(data).hexdigest()
+
+    assert compute_content_hash(path) == expected
+    assert compute_content_hash(path, size) == expected
+
+
+def test_content_hash_without_file_digest(tmp_path, monkeypatch):
+    # Python < 3.11 falls back to a chunked read loop
+    monkeypatch.delattr(hashlib, "file_digest", raising=False)
+    path = tmp_path / "design.dxf"
+    data = _write_random(path, 2 * SMALL_FILE_SIZE + 7)
+
+    assert compute_content_hash(path) == hashlib.sha256(data).hexdigest()
+
+
+@pytest.mark.parametrize("actual, hint", [
+    (SMALL_FILE_SIZE + 4096, 10),  # grew past the single-read limit
+    (100, 5 * SMALL_FILE_SIZE),  # shrank since it was stat'ed
+])
+def test_content_hash_ignores_stale_size_hint(tmp_path, actual, hint):
+    path = tmp_path / "design.dxf"
+    data = _write_random(path, actual)
+
+    assert compute_content_hash(path, hint) == hashlib.sha256(data).hexdigest()
+
+
+def test_content_hashes_batch_keeps_input_order(tmp_path):
+    sizes = [10, 2 * SMALL_FILE_SIZE, 0, 5000, SMALL_FILE_SIZE + 1]
+    paths, expected = [], []
+    for i, size in enumerate(sizes):
+        path = tmp_path / f"{i}.svg"
+        expected.append(hashlib.sha256(_write_random(path, size, seed=i)).hexdigest())
+        paths.append(path)
+
+    def unexpected(path, e):
+        pytest.fail(f"{path}: {e}")
+
+    # Largest files are submitted first, so results arrive out of input order
+    assert compute_content_hashes_batch(paths, sizes, 3, unexpected) == expected
+    assert compute_content_hashes_batch(paths, [None] * len(paths), 2, unexpected) == expected
+
+
+def test_content_hashes_batch_reports_unreadable_files(tmp_path):
+    good = tmp_path / "good.svg"
+    data = _write_random(good, 64)
+    missing = tmp_path / "missing.svg"
+    errors = []
+
+    hashes = compute_content_hashes_batch(
+        [missing, good], [None, 64], 2, lambda path, e: errors.append((path, e))
+    )
+
+    assert hashes == [None, hashlib.sha256(data).hexdigest()]
+    assert [path for path, _ in errors] == [missing]
+    assert isinstance(errors[0][1], FileNotFoundError)
+
+
+# ---------------------------------------------------------------------------
+# Supabase lookups
+# ---------------------------------------------------------------------------
+
+
+def _encoded_size(batch: list[str]) -> int:
+    return sum(len(quote(in_filter([value])[1:-1], safe="")) + 3 for value in batch)
+
+
+def test_lookup_batches_keep_small_lists_together():
+    values = [f"{i:064x}" for i in range(10)]
+
+    assert list(lookup_batches(values)) == [values]
+    assert list(lookup_batches([])) == []
+
+
+def test_lookup_batches_split_by_encoded_length():
+    # Encoding makes these paths several times longer than their raw length
+    values = [f"Κατάλογος/σχέδια (v2)/αρχείο, τελικό {i}.dxf" for i in range(500)]
+
+    batches = list(lookup_batches(values))
+
+    assert len(batches) > 1
+    assert [value for batch in batches for value in batch] == values
+    assert all(_encoded_size(batch) <= LOOKUP_MAX_CHARS for batch in batches)
+
+
+def test_lookup_batches_put_oversized_value_alone():
+    huge = "x" * (LOOKUP_MAX_CHARS + 1)
+
+    assert list(lookup_batches(["a", huge, "b"])) == [["a"], [huge], ["b"]]
+
+
+class StubQuery:
+    """Records one table call and answers it from the stub client's handler."""
+
+    def __init__(self, client: "StubSupabase", table: str):
+        self.client = client
+        self.table = table
+
+    def _call(self, op: str, rows, **kwargs) -> "StubQuery":
+        self.op, self.rows = op, rows
+        self.client.calls.append((self.table, op, rows, kwargs))
+        return self
+
+    def insert(self, rows, **kwargs):
+        return self._call("insert", rows, **kwargs)
+
+    def upsert(self, rows, **kwargs):
+        return self._call("upsert", rows, **kwargs)
+
+    def select(self, columns: str):
+        # A select's "rows" are the filters applied to it
+        return self._call("select", [])
+
+    def filter(self, column: str, operator: str, criteria: str):
+        self.rows.append((column, operator, criteria))
+        return self
+
+    def eq(self, column: str, value: str):
+        return self.filter(column, "eq", value)
+
+    def execute(self):
+        handler = self.client.handlers.get((self.table, self.op), lambda rows: [])
+        return SimpleNamespace(data=handler(self.rows))
+
+
+class StubSupabase:
+    """Minimal Supabase client: `handlers[(table, op)]` maps rows to result data."""
+
+    def __init__(self, handlers: Optional[dict] = None):
+        self.handlers = handlers or {}
+        self.calls = []
+
+    def table(self, name: str) -> StubQuery:
+        return StubQuery(self, name)
+
+    def calls_to(self, table: str, op: str) -> list:
+        return [(rows, kwargs) for t, o, rows, kwargs in self.calls if (t, o) == (table, op)]
+
+
+def _metadata(title: str = "Celtic Knot", tags: Optional[list[str]] = None) -> AIMetadata:
+    return AIMetadata(
+        title=title,
+        description="A design",
+        project_type=None,
+        difficulty=None,
+        materials=[],
+        categories=[],
+        style=None,
+        tags=tags or [],
+        approx_dimensions=None,
+    )
+
+
+def _tag_rows(rows: list[dict]) -> list[dict]:
+    return [{"id": f"tag-{row['name']}", "name": row["name"]} for row in rows]
+
+
+def _design_rows(rows: dict) -> list[dict]:
+    return [{"id": f"design-{rows['slug']}"}]
+
+
+def test_link_tags_upserts_sorted_normalized_unique_names():
+    client = StubSupabase({("tags", "upsert"): _tag_rows})
+    store = DesignStore(client)
+
+    store._link_tags("design-1", ["Wood", " celtic ", "wood", "", "  ", "Knot"])
+
+    [(tag_rows, tag_kwargs)] = client.calls_to("tags", "upsert")
+    assert tag_rows == [{"name": "celtic"}, {"name": "knot"}, {"name": "wood"}]
+    assert tag_kwargs == {"on_conflict": "name"}
+
+    [(link_rows, link_kwargs)] = client.calls_to("design_tags", "upsert")
+    assert link_rows == [
+        {"design_id": "design-1", "tag_id": "tag-celtic"},
+        {"design_id": "design-1", "tag_id": "tag-knot"},
+        {"design_id": "design-1", "tag_id": "tag-wood"},
+    ]
+    assert link_kwargs["ignore_duplicates"] is True
+
+
+def test_link_tags_reuses_cached_tag_ids():
+    client = StubSupabase({("tags", "upsert"): _tag_rows})
+    store = DesignStore(client)
+
+    store._link_tags("design-1", ["wood", "knot"])
+    store._link_tags("design-2", ["Knot", "wood", "box"])
+    store._link_tags("design-3", ["wood"])
+
+    assert [rows for rows, _ in client.calls_to("tags", "upsert")] == [
+        [{"name": "knot"}, {"name": "wood"}],
+        [{"name": "box"}],
+    ]
+    link_calls = client.calls_to("design_tags", "upsert")
+    assert link_calls[1][0] == [
+        {"design_id": "design-2", "tag_id": f"tag-{name}"} for name in ["box", "knot", "wood"]
+    ]
+    assert link_calls[2][0] == [{"design_id": "design-3", "tag_id": "tag-wood"}]
+
+
+def test_link_tags_skips_empty_tag_lists():
+    client = StubSupabase()
+
+    DesignStore(client)._link_tags("design-1", ["", "  "])
+
+    assert client.calls == []
+
+
+def test_create_design_only_warns_when_tags_fail(caplog):
+    def fail(rows):
+        raise PostgrestAPIError({"code": "57014", "message": "statement timeout"})
+
+    client = StubSupabase({("designs", "insert"): _design_rows, ("tags", "upsert"): fail})
+    store = DesignStore(client)
+
+    with caplog.at_level("WARNING", logger="ingest"):
+        design_id = store.create_design(_metadata(tags=["wood"]), "", "ab" * 32)
+
+    assert design_id == "design-celtic-knot"
+    assert "Could not link tags for design design-celtic-knot" in caplog.text
+    assert client.calls_to("design_tags", "upsert") == []
+
+
+def test_in_filter_quotes_and_escapes_every_value():
+    assert in_filter(["a.svg", 'signs/12" sign (v2).svg', "dir\\x.dxf"]) == (
+        '("a.svg","signs/12\\" sign (v2).svg","dir\\\\x.dxf")'
+    )
+
+
+def test_lookup_batches_count_escaped_quotes():
+    values = [f'{i}" sign.svg' for i in range(400)]
+
+    batches = list(lookup_batches(values))
+
+    assert len(batches) > 1
+    assert all(len(quote(in_filter(batch), safe="")) <= LOOKUP_MAX_CHARS for batch in batches)
+
+
+def _version_rows(filters: list[tuple]) -> list[dict]:
+    """design_files select handler: versions 1-3 of a.svg and v1 of everything else."""
+    [(column, operator, criteria)] = filters
+    assert column == "source_path"
+    paths = [criteria] if operator == "eq" else [
+        value.replace('\\"', '"') for value in criteria[2:-2].split('","')
+    ]
+    rows = []
+    for path in paths:
+        versions = [2, 3, 1] if path == "a.svg" else [1]
+        rows += [
+            {"id": f"{path}-v{v}", "source_path": path, "version_number": v}
+            for v in versions
+        ]
+    return rows
+
+
+def test_find_by_source_paths_keeps_latest_version():
+    client = StubSupabase({("design_files", "select"): _version_rows})
+    paths = ["a.svg", 'signs/12" sign (v2).svg']
+
+    latest = DesignStore(client).find_by_source_paths(paths, pytest.fail)
+
+    assert {path: row["id"] for path, row in latest.items()} == {
+        "a.svg": "a.svg-v3",
+        'signs/12" sign (v2).svg': 'signs/12" sign (v2).svg-v1',
+    }
+    [(filters, _)] = client.calls_to("design_files", "select")
+    assert filters == [("source_path", "in", in_filter(paths))]
+
+
+def test_find_by_source_paths_retries_failed_batch_per_file():
+    def select(filters):
+        [(_, operator, criteria)] = filters
+        if operator == "in" or criteria == "bad.svg":
+            raise PostgrestAPIError({"code": "PGRST100", "message": "failed to parse filter"})
+        return _version_rows(filters)
+
+    client = StubSupabase({("design_files", "select"): select})
+    errors = []
+
+    latest = DesignStore(client).find_by_source_paths(
+        ["a.svg", "bad.svg", "b.svg"], lambda path, e: errors.append(path)
+    )
+
+    assert {path: row["version_number"] for path, row in latest.items()} == {
+        "a.svg": 3, "b.svg": 1,
+    }
+    assert errors == ["bad.svg"]
+
+
+CONTENT_HASH = "0123456789abcdef" * 4
+
+
+def _taken_slugs(*taken: str, code: str = "23505"):
+    """Designs insert handler that rejects the given slugs."""
+    def insert(rows: dict) -> list[dict]:
+        if rows["slug"] in taken:
+            raise PostgrestAPIError({"code": code, "message": "duplicate key value"})
+        return _design_rows(rows)
+    return insert
+
+
+def _tried_slugs(client: StubSupabase) -> list[str]:
+    return [rows["slug"] for rows, _ in client.calls_to("designs", "insert")]
+
+
+def test_create_design_retries_taken_slug_with_hash_prefix():
+    client = StubSupabase({("designs", "insert"): _taken_slugs("celtic-knot")})
+
+    design_id = DesignStore(client).create_design(_metadata(), "", CONTENT_HASH)
+
+    assert design_id == "design-celtic-knot-01234567"
+    assert _tried_slugs(client) == ["celtic-knot", "celtic-knot-01234567"]
+
+
+def test_create_design_reraises_other_errors_immediately():
+    client = StubSupabase({("designs", "insert"): _taken_slugs("celtic-knot", code="42501")})
+
+    with pytest.raises(PostgrestAPIError) as excinfo:
+        DesignStore(client).create_design(_metadata(), "", CONTENT_HASH)
+
+    assert excinfo.value.code == "42501"
+    assert _tried_slugs(client) == ["celtic-knot"]
+
+
+def test_create_design_reraises_when_every_slug_is_taken():
+    client = StubSupabase({("designs", "insert"): _taken_slugs(
+        "celtic-knot", "celtic-knot-01234567", f"celtic-knot-{CONTENT_HASH}"
+    )})
+
+    with pytest.raises(PostgrestAPIError) as excinfo:
+        DesignStore(client).create_design(_metadata(), "", CONTENT_HASH)
+
+    assert excinfo.value.code == "23505"
+    assert _tried_slugs(client) == [
+        "celtic-knot", "celtic-knot-01234567", f"celtic-knot-{CONTENT_HASH}"
+    ]
+
+
+# ---------------------------------------------------------------------------
+# Previews
+# ---------------------------------------------------------------------------
+
+
+def test_resample_filter_accepts_any_case():
+    assert resample_filter("bicubic") is Image.Resampling.BICUBIC
+    assert resample_filter(" Lanczos ") is Image.Resampling.LANCZOS
+
+
+def test_resample_filter_rejects_unknown_names():
+    with pytest.raises(ValueError, match="PREVIEW_RESAMPLE 'lanczoz'.*BICUBIC.*LANCZOS"):
+        resample_filter("lanczoz")
+
+
+# ---------------------------------------------------------------------------
+# Duplicate prefilter
+# ---------------------------------------------------------------------------
+
+
+def _sha(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _duplicate_rows(known: dict[str, str]):
+    """design_files select handler for find_duplicates: hash -> design_id."""
+    def select(filters: list[tuple]) -> list[dict]:
+        [(column, _, criteria)] = filters
+        assert column == "content_hash"
+        hashes = criteria[2:-2].split('","')
+        return [
+            {"id": f"file-{h}", "design_id": known[h], "version_number": 1, "content_hash": h}
+            for h in hashes if h in known
+        ]
+    return select
+
+
+@pytest.fixture
+def make_ingester(tmp_path, monkeypatch):
+    """Build DesignIngesters on a stub Supabase client and a tmp_path seen cache."""
+    monkeypatch.setattr(ingest_designs, "SUPABASE_URL", STAGING)
+    monkeypatch.setattr(ingest_designs, "SUPABASE_SERVICE_KEY", "service-key")
+    monkeypatch.setattr(ingest_designs, "SEEN_CACHE_PATH", "")
+    monkeypatch.setattr(ingest_designs, "HASH_WORKERS", 2)
+    ingesters = []
+
+    def make(known: dict[str, str]):
+        ingester = ingest_designs.DesignIngester()
+        ingester.store = DesignStore(StubSupabase({
+            ("design_files", "select"): _duplicate_rows(known),
+        }))
+        ingester.seen = SeenCache(tmp_path / "seen.sqlite", STAGING)
+        ingesters.append(ingester)
+        return ingester
+
+    yield make
+    for ingester in ingesters:
+        ingester.close()
+
+
+@pytest.fixture
+def hashed_paths(monkeypatch):
+    """Record every path the prefilter hashes."""
+    paths = []
+    real = ingest_designs.compute_content_hashes_batch
+
+    def batch(to_hash, *args):
+        paths.extend(to_hash)
+        return real(to_hash, *args)
+
+    monkeypatch.setattr(ingest_designs, "compute_content_hashes_batch", batch)
+    return paths
+
+
+def _cached(ingester, path: Path) -> Optional[tuple]:
+    stat = path.stat()
+    return ingester.seen.get(str(path.absolute()), stat.st_mtime_ns, stat.st_size)
+
+
+def _counts(ingester) -> tuple[int, int, int]:
+    return tuple(ingester.stats[key] for key in ("scanned", "skipped_duplicate", "errors"))
+
+
+def _prefilter_library(root: Path) -> dict[str, Path]:
+    files = {}
+    for name, data in [("a.svg", b"A"), ("copy.svg", b"A"), ("known.svg", b"K")]:
+        files[name] = root / name
+        files[name].write_bytes(data)
+    # Stats fine but can't be opened, so hashing fails
+    files["dir.svg"] = root / "dir.svg"
+    files["dir.svg"].mkdir()
+    files["gone.svg"] = root / "gone.svg"
+    return files
+
+
+def test_prefilter_drops_duplicates_and_records_seen_rows(tmp_path, make_ingester, hashed_paths):
+    root = tmp_path / "designs"
+    root.mkdir()
+    files = _prefilter_library(root)
+    ingester = make_ingester({_sha(b"K"): "design-k"})
+
+    survivors = ingester._prefilter_duplicates(sorted(files.values()))
+
+    assert [(path, h, stat.st_size) for path, h, stat in survivors] == [
+        (files["a.svg"], _sha(b"A"), 1)
+    ]
+    assert survivors[0][2].st_mtime_ns == files["a.svg"].stat().st_mtime_ns
+    assert _counts(ingester) == (3, 2, 2)
+    assert files["gone.svg"] not in hashed_paths
+    # Hashed files are remembered; only known designs are marked ingested
+    assert _cached(ingester, files["a.svg"]) == (_sha(b"A"), None)
+    assert _cached(ingester, files["copy.svg"]) == (_sha(b"A"), None)
+    assert _cached(ingester, files["known.svg"]) == (_sha(b"K"), "design-k")
+
+
+def test_prefilter_second_run_is_served_from_seen_cache(tmp_path, make_ingester, hashed_paths):
+    root = tmp_path / "designs"
+    root.mkdir()
+    files = _prefilter_library(root)
+    make_ingester({_sha(b"K"): "design-k"})._prefilter_duplicates(sorted(files.values()))
+    hashed_paths.clear()
+
+    # Another machine has since ingested "A"
+    second = make_ingester({_sha(b"K"): "design-k", _sha(b"A"): "design-a"})
+    survivors = second._prefilter_duplicates(sorted(files.values()))
+
+    assert survivors == []
+    # Only the file that failed to hash is hashed again
+    assert hashed_paths == [files["dir.svg"]]
+    assert _counts(second) == (3, 3, 2)
+    assert _cached(second, files["a.svg"]) == (_sha(b"A"), "design-a")
+    assert _cached(second, files["copy.svg"]) == (_sha(b"A"), "design-a")
+    # known.svg was skipped without asking Supabase about its hash
+    [(filters, _)] = second.store.supabase.calls_to("design_files", "select")
+    assert _sha(b"K") not in filters[0][2]
+
+    third = make_ingester({})
+    assert third._prefilter_duplicates(sorted(files.values())) == []
+    assert _counts(third) == (3, 3, 2)
+
+
+# ---------------------------------------------------------------------------
+# Ingest pipeline
+# ---------------------------------------------------------------------------
+
+
+class StageCrash(BaseException):
+    """Escapes safe_call the way a non-Exception error would."""
+
+
+class FakeIngester:
+    """Duck-typed stand-in for DesignIngester, recording what each stage saw."""
+
+    def __init__(self, fail_phashes=False, fail_ingest=None):
+        self.fail_phashes = fail_phashes
+        self.fail_ingest = fail_ingest
+        self.ai_requests = []
+        self.ingested = []
+        self.errors = []
+        self._lock = threading.Lock()
+
+    def prepare_file(self, path, directory, content_hash, file_stat):
+        # Odd-numbered files already exist, so they become new versions
+        index = int(path.stem)
+        return SimpleNamespace(
+            path=path,
+            content_hash=content_hash,
+            size_bytes=file_stat.st_size,
+            existing={"design_id": "d"} if index % 2 else None,
+            preview=b"png",
+            phash=None,
+            metadata=None,
+        )
+
+    def fill_phashes(self, design_files):
+        if self.fail_phashes:
+            raise RuntimeError("phash failed")
+        for design_file in design_files:
+            design_file.phash = f"phash-{design_file.content_hash}"
+
+    async def get_ai_metadata_async(self, client, design_file):
+        with self._lock:
+            self.ai_requests.append(design_file.path)
+        design_file.metadata = f"{client}-{design_file.path.stem}"
+
+    def ingest_file(self, design_file):
+        if self.fail_ingest:
+            raise self.fail_ingest
+        with self._lock:
+            self.ingested.append(design_file)
+
+    def safe_call(self, file_path, func, *args):
+        try:
+            return func(*args)
+        except Exception as e:
+            with self._lock:
+                self.errors.append((file_path, e))
+            return None
+
+
+class FakeAIClient:
+    async def __aenter__(self):
+        return "ai"
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+def _pipeline_files(tmp_path: Path, count: int) -> list[tuple[Path, str, os.stat_result]]:
+    files = []
+    for i in range(count):
+        path = _touch(tmp_path / f"{i}.svg")
+        files.append((path, f"hash-{i}", path.stat()))
+    return files
+
+
+def _run_pipeline(ingester, files, directory, ai_client=None, timeout=10.0):
+    """Run the pipeline on a thread, failing the test instead of hanging."""
+    pipeline = IngestPipeline(
+        ingester,
+        preview_workers=2,
+        ingest_workers=2,
+        ai_concurrency=3,
+        phash_batch_size=4,
+        ai_client=ai_client,
+    )
+    outcome = {}
+
+    def target():
+        try:
+            pipeline.run(files, directory)
+        except BaseException as e:
+            outcome["error"] = e
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "pipeline did not finish"
+    return outcome.get("error")
+
+
+def test_pipeline_ingests_every_file_without_ai(tmp_path):
+    ingester = FakeIngester()
+    files = _pipeline_files(tmp_path, 25)
+
+    assert _run_pipeline(ingester, files, tmp_path) is None
+
+    assert sorted(d.content_hash for d in ingester.ingested) == sorted(h for _, h, _ in files)
+    assert all(d.phash == f"phash-{d.content_hash}" for d in ingester.ingested)
+    assert all(d.metadata is None for d in ingester.ingested)
+    assert ingester.ai_requests == []
+
+
+def test_pipeline_fetches_ai_metadata_for_new_designs_only(tmp_path):
+    ingester = FakeIngester()
+    files = _pipeline_files(tmp_path, 25)
+
+    assert _run_pipeline(ingester, files, tmp_path, ai_client=FakeAIClient) is None
+
+    assert len(ingester.ingested) == len(files)
+    for design_file in ingester.ingested:
+        if design_file.existing:
+            assert design_file.metadata is None
+        else:
+            assert design_file.metadata == f"ai-{design_file.path.stem}"
+    assert sorted(ingester.ai_requests) == sorted(p for p, _, _ in files if int(p.stem) % 2 == 0)
+
+
+def test_pipeline_records_per_file_errors_and_continues(tmp_path):
+    ingester = FakeIngester(fail_ingest=ValueError("upload failed"))
+    files = _pipeline_files(tmp_path, 6)
+
+    assert _run_pipeline(ingester, files, tmp_path) is None
+
+    assert sorted(path for path, _ in ingester.errors) == sorted(p for p, _, _ in files)
+
+
+def test_pipeline_reraises_when_enrich_stage_fails(tmp_path):
+    ingester = FakeIngester(fail_phashes=True)
+    files = _pipeline_files(tmp_path, 50)
+
+    started = time.monotonic()
+    error = _run_pipeline(ingester, files, tmp_path, ai_client=FakeAIClient)
+
+    assert isinstance(error, RuntimeError)
+    assert str(error) == "phash failed"
+    assert time.monotonic() - started < 5
+    assert ingester.ingested == []
+
+
+def test_pipeline_reraises_when_ingest_stage_fails(tmp_path):
+    ingester = FakeIngester(fail_ingest=StageCrash("ingest died"))
+    files = _pipeline_files(tmp_path, 50)
+
+    started = time.monotonic()
+    error = _run_pipeline(ingester, files, tmp_path)
+
+    assert isinstance(error, StageCrash)
+    assert time.monotonic() - started < 5